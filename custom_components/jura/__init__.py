@@ -1,48 +1,192 @@
+import asyncio
 import logging
 
+import voluptuous as vol
+from bleak import BLEDevice
+from habluetooth import get_manager
 from homeassistant.components import bluetooth
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant, callback
+from homeassistant.core import (
+    HomeAssistant,
+    ServiceCall,
+    ServiceResponse,
+    SupportsResponse,
+    callback,
+)
+from homeassistant.exceptions import HomeAssistantError, ServiceValidationError
+from homeassistant.helpers import config_validation as cv, device_registry as dr
+from homeassistant.helpers.typing import ConfigType
 
 from .core import DOMAIN
-from .core.device import Device, EmptyModel, UnsupportedModel, get_machine
+from .core.arbiter import ADAPTER_SLOTS, arbiter
+from .core.device import (
+    NUMBERS,
+    RSSI_INTERVAL,
+    SELECTS,
+    Device,
+    EmptyModel,
+    UnsupportedModel,
+    async_get_machine,
+    get_model_id,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
-PLATFORMS = ["binary_sensor", "button", "number", "select", "switch"]
+PLATFORMS = ["binary_sensor", "button", "number", "select", "sensor", "switch"]
+
+CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
+
+MAKE_PRODUCT_SCHEMA = vol.Schema(
+    {
+        vol.Required("device_id"): cv.string,
+        vol.Required("product"): cv.string,
+        **{vol.Optional(attr): cv.string for attr in SELECTS if attr != "product"},
+        **{vol.Optional(attr): vol.Coerce(int) for attr in NUMBERS},
+    }
+)
+
+
+async def async_setup(hass: HomeAssistant, config: ConfigType):
+    async def make_product(call: ServiceCall) -> ServiceResponse:
+        device = get_device(hass, call.data["device_id"])
+        options = {k: v for k, v in call.data.items() if k in SELECTS or k in NUMBERS}
+        options.pop("product", None)
+
+        try:
+            await device.make_product(call.data["product"], options)
+        except ValueError as e:
+            raise ServiceValidationError(str(e)) from e
+        except Exception as e:
+            raise HomeAssistantError(f"Can't make product: {e!r}") from e
+
+        return {"success": True}
+
+    hass.services.async_register(
+        DOMAIN,
+        "make_product",
+        make_product,
+        MAKE_PRODUCT_SCHEMA,
+        SupportsResponse.OPTIONAL,
+    )
+
+    return True
+
+
+def get_device(hass: HomeAssistant, device_id: str) -> Device:
+    if device_entry := dr.async_get(hass).async_get(device_id):
+        devices = hass.data.get(DOMAIN, {})
+        for entry_id in device_entry.config_entries:
+            if device := devices.get(entry_id):
+                return device
+    raise ServiceValidationError(f"Unknown Jura device: {device_id}")
 
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
     devices = hass.data.setdefault(DOMAIN, {})
 
+    resolving: asyncio.Future | None = None
+    last_info: bluetooth.BluetoothServiceInfoBleak | None = None
+
+    adapters = await get_manager().async_get_bluetooth_adapters()
+
     @callback
     def update_ble(
         service_info: bluetooth.BluetoothServiceInfoBleak,
         change: bluetooth.BluetoothChange,
     ) -> None:
+        nonlocal resolving, last_info
+
         _LOGGER.debug(f"{change} {service_info.advertisement}")
 
+        if service_info.source not in arbiter.slots:
+            update_slots(hass, service_info.source, adapters)
+
         if device := devices.get(entry.entry_id):
-            device.update_ble(service_info.advertisement)
+            device.update_ble(
+                service_info.advertisement, service_info.device, service_info.source
+            )
+            return
+
+        # while machine is resolving - only remember latest RSSI and BLEDevice
+        last_info = service_info
+        if resolving and not resolving.done():
+            return
+
+        adv = service_info.advertisement.manufacturer_data[171]
+        future = async_get_machine(get_model_id(adv))
+        if future is resolving:
+            return  # same failed model, already handled
+
+        resolving = future
+        future.add_done_callback(machine_resolved)
+
+    @callback
+    def machine_resolved(future: asyncio.Future) -> None:
+        if entry.entry_id in devices:
             return
 
         try:
-            machine = get_machine(service_info.advertisement.manufacturer_data[171])
-        except EmptyModel:
+            machine = future.result()
+        except (asyncio.CancelledError, EmptyModel):
             return
         except UnsupportedModel as e:
             _LOGGER.error("Unsupported model: %s", *e.args)
             return
+        except Exception as e:
+            _LOGGER.warning("Can't load machine", exc_info=e)
+            return
 
-        devices[entry.entry_id] = device = Device(
-            entry.title, machine["model"], machine["products"], service_info.device
+        # save model for instant setup after restart
+        hass.config_entries.async_update_entry(
+            entry,
+            data={
+                **entry.data,
+                "model_id": machine["model_id"],
+                "model": machine["model"],
+            },
         )
-        device.update_ble(service_info.advertisement)
+
+        device = setup_device(machine, last_info.device)
+        device.update_ble(last_info.advertisement, last_info.device, last_info.source)
 
         hass.create_task(
             hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
         )
 
+    def setup_device(machine: dict, ble_device: BLEDevice) -> Device:
+        devices[entry.entry_id] = device = Device(
+            entry.title,
+            machine["model"],
+            machine["products"],
+            ble_device,
+            machine["alerts"],
+            machine["counters"],
+            machine["maintenance"],
+            rssi_interval=get_rssi_interval(entry),
+            stats_interval=get_stats_interval(entry),
+        )
+        return device
+
+    entry.async_on_unload(entry.add_update_listener(update_options))
+
+    entry.async_on_unload(
+        lambda: resolving and resolving.remove_done_callback(machine_resolved)
+    )
+
+    if model_id := entry.data.get("model_id"):
+        try:
+            machine = await async_get_machine(model_id)
+        except Exception as e:
+            _LOGGER.warning("Can't load saved model: %s", model_id, exc_info=e)
+        else:
+            mac = entry.data["mac"]
+            # live BLEDevice will be attached with next advertisement
+            ble_device = bluetooth.async_ble_device_from_address(
+                hass, mac, connectable=True
+            ) or BLEDevice(mac, None, {}, 0)
+            setup_device(machine, ble_device)
+            await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+
     # https://developers.home-assistant.io/docs/core/bluetooth/api/
     entry.async_on_unload(
         bluetooth.async_register_callback(
@@ -56,7 +200,35 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
     return True
 
 
+@callback
+def update_slots(hass: HomeAssistant, source: str, adapters: dict):
+    """Connection slots of local adapter from HA, proxies use arbiter default."""
+    if not (scanner := bluetooth.async_scanner_by_source(hass, source)):
+        return
+    if details := adapters.get(scanner.adapter):
+        slots = details.get(bluetooth.ADAPTER_CONNECTION_SLOTS)
+        arbiter.set_slots(source, slots or bluetooth.DEFAULT_CONNECTION_SLOTS)
+    else:
+        arbiter.set_slots(source, ADAPTER_SLOTS)
+
+
+def get_rssi_interval(entry: ConfigEntry) -> float:
+    return entry.options.get("rssi_interval", RSSI_INTERVAL)
+
+
+def get_stats_interval(entry: ConfigEntry) -> float:
+    # option in minutes
+    return entry.options.get("stats_interval", 60) * 60
+
+
+async def update_options(hass: HomeAssistant, entry: ConfigEntry):
+    if device := hass.data[DOMAIN].get(entry.entry_id):
+        device.rssi_interval = get_rssi_interval(entry)
+        device.stats_interval = get_stats_interval(entry)
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
-    if entry.entry_id in hass.data[DOMAIN]:
+    if device := hass.data[DOMAIN].pop(entry.entry_id, None):
+        device.client.ping_cancel()
         await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     return True
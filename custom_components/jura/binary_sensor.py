@@ -8,6 +8,7 @@ from homeassistant.core import HomeAssistant
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 
 from . import DOMAIN
+from .core.device import Device
 from .core.entity import JuraEntity
 
 
@@ -16,16 +17,42 @@ async def async_setup_entry(
 ):
     device = hass.data[DOMAIN][config_entry.entry_id]
 
-    add_entities([JuraSensor(device, "connection")])
+    add_entities(
+        [JuraSensor(device, "connection")]
+        + [JuraAlert(device, attr) for attr in device.alerts]
+    )
 
 
 class JuraSensor(JuraEntity, BinarySensorEntity):
     _attr_device_class = BinarySensorDeviceClass.CONNECTIVITY
     _attr_entity_category = EntityCategory.DIAGNOSTIC
 
+    def __init__(self, device: Device, attr: str):
+        super().__init__(device, attr)
+        device.register_update("conn_info", self.internal_update)
+
     def internal_update(self):
         self._attr_is_on = self.device.connected
         self._attr_extra_state_attributes = self.device.conn_info
 
         if self.hass:
             self._async_write_ha_state()
+
+
+class JuraAlert(JuraEntity, BinarySensorEntity):
+    def __init__(self, device: Device, attr: str):
+        # only alerts with type require user action, other bits are machine state
+        if device.alerts[attr][2] is not None:
+            self._attr_device_class = BinarySensorDeviceClass.PROBLEM
+        else:
+            self._attr_entity_registry_enabled_default = False
+        super().__init__(device, attr)
+
+    def internal_update(self):
+        attribute = self.device.attribute(self.attr)
+
+        self._attr_available = "is_on" in attribute
+        self._attr_is_on = attribute.get("is_on")
+
+        if self.hass:
+            self._async_write_ha_state()
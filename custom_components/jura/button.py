@@ -1,9 +1,11 @@
 from homeassistant.components.button import ButtonEntity
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
+from homeassistant.exceptions import HomeAssistantError
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 
 from .core import DOMAIN
+from .core.device import Device
 from .core.entity import JuraEntity
 
 
@@ -16,6 +18,10 @@ async def async_setup_entry(
 
 
 class JuraButton(JuraEntity, ButtonEntity):
+    def __init__(self, device: Device, attr: str):
+        super().__init__(device, attr)
+        device.register_update("product", self.internal_update)
+
     def internal_update(self):
         self._attr_available = self.device.product is not None
 
@@ -23,4 +29,7 @@ class JuraButton(JuraEntity, ButtonEntity):
             self._async_write_ha_state()
 
     async def async_press(self) -> None:
-        self.device.start_product()
+        try:
+            await self.device.start_product()
+        except Exception as e:
+            raise HomeAssistantError(f"Can't make product: {e!r}") from e
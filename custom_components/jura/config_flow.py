@@ -1,8 +1,13 @@
 import voluptuous as vol
 from homeassistant.components import bluetooth
-from homeassistant.config_entries import ConfigFlow
+from homeassistant.config_entries import ConfigEntry, ConfigFlow, OptionsFlow
+from homeassistant.core import callback
 
 from .core import DOMAIN
+from .core.device import RSSI_INTERVAL
+
+# intervals in options, zero would mean update on each event
+INTERVAL = vol.All(vol.Coerce(int), vol.Range(min=1))
 
 
 class FlowHandler(ConfigFlow, domain=DOMAIN):
@@ -21,3 +26,31 @@ class FlowHandler(ConfigFlow, domain=DOMAIN):
                 }
             ),
         )
+
+    @staticmethod
+    @callback
+    def async_get_options_flow(entry: ConfigEntry):
+        return OptionsFlowHandler(entry)
+
+
+class OptionsFlowHandler(OptionsFlow):
+    def __init__(self, entry: ConfigEntry):
+        self.entry = entry
+
+    async def async_step_init(self, user_input=None):
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
+
+        options = self.entry.options
+        rssi_interval = options.get("rssi_interval", RSSI_INTERVAL)
+        stats_interval = options.get("stats_interval", 60)
+
+        return self.async_show_form(
+            step_id="init",
+            data_schema=vol.Schema(
+                {
+                    vol.Required("rssi_interval", default=rssi_interval): INTERVAL,
+                    vol.Required("stats_interval", default=stats_interval): INTERVAL,
+                }
+            ),
+        )
@@ -0,0 +1,32 @@
+from datetime import date
+
+
+def decode_date(value: int) -> date | None:
+    try:
+        return date((value >> 9) + 1990, (value >> 5) & 0xF, value & 0x1F)
+    except ValueError:
+        return None
+
+
+def parse_advertisement(data: bytes) -> dict:
+    """Parse manufacturer data (id 171) from BlueFrog advertisement.
+
+    0: session key, 1-2: BlueFrog version, 4-5: model id, 6-7: machine number,
+    8-9: serial number, 10-11: production date, 12-13: UCHI production date,
+    15: status bits. All numbers are little endian.
+    """
+    info = {}
+    if len(data) >= 3:
+        info["key"] = data[0]
+        info["firmware"] = f"{data[1]}.{data[2]}"
+    if len(data) >= 6:
+        info["model_id"] = int.from_bytes(data[4:6], "little")
+    if len(data) >= 10:
+        info["machine_number"] = int.from_bytes(data[6:8], "little")
+        info["serial_number"] = int.from_bytes(data[8:10], "little")
+    if len(data) >= 14:
+        info["production_date"] = decode_date(int.from_bytes(data[10:12], "little"))
+        info["uchi_date"] = decode_date(int.from_bytes(data[12:14], "little"))
+    if len(data) >= 16:
+        info["status_bits"] = data[15]
+    return info
@@ -0,0 +1,152 @@
+import asyncio
+import itertools
+import logging
+from collections import deque
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .client import Client
+
+_LOGGER = logging.getLogger(__name__)
+
+# connection slots for unknown adapter or proxy (ESPHome proxy has 3 slots)
+ADAPTER_SLOTS = 3
+
+
+def get_source(client: "Client") -> str:
+    # adapter or proxy of client's BLEDevice, same as in HA service info
+    if client.source:
+        return client.source
+    # remote scanners also store it in BLEDevice details
+    details = client.device.details
+    if isinstance(details, dict) and details.get("source"):
+        return details["source"]
+    return "default"
+
+
+class Arbiter:
+    """Process-wide connection slots manager for all Jura clients. Clients with
+    pending commands go first and can evict idle keepalive connections.
+    """
+
+    def __init__(self):
+        self.slots: dict[str, int] = {}
+        # source => connected or connecting clients
+        self.active: dict[str, set["Client"]] = {}
+        # client => (source, seq, future)
+        self.waiters: dict["Client", tuple[str, int, asyncio.Future]] = {}
+        self.seq = itertools.count()
+
+        self.wait_time: deque[float] = deque(maxlen=100)
+        self.evictions = 0
+
+    def set_slots(self, source: str, slots: int):
+        self.slots[source] = slots
+
+    def free_slots(self, source: str) -> int:
+        slots = self.slots.get(source, ADAPTER_SLOTS)
+        return slots - len(self.active.get(source, ()))
+
+    async def acquire(self, client: "Client") -> bool:
+        """Wait for free connection slot. Return False if waiting was cancelled
+        or client ping time is over.
+        """
+        source = get_source(client)
+
+        if self.free_slots(source) > 0 and not self._has_waiters(source):
+            self.active.setdefault(source, set()).add(client)
+            self.wait_time.append(0)
+            return True
+
+        start = client.loop.time()
+        future = client.loop.create_future()
+        self.waiters[client] = (source, next(self.seq), future)
+
+        def expire():
+            nonlocal timer
+            # ping() could extend client window while waiting
+            if client.loop.time() < client.ping_time:
+                timer = client.loop.call_at(client.ping_time, expire)
+            else:
+                self.cancel(client)
+
+        timer = client.loop.call_at(client.ping_time, expire)
+
+        self.notify(client)
+
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # slot could be given right before task was cancelled
+            self.release(client)
+            raise
+        finally:
+            timer.cancel()
+            self.waiters.pop(client, None)
+            self.wait_time.append(client.loop.time() - start)
+
+    def release(self, client: "Client"):
+        for source, clients in self.active.items():
+            if client in clients:
+                clients.discard(client)
+                self._wakeup(source)
+                return
+
+    def cancel(self, client: "Client"):
+        if item := self.waiters.get(client):
+            if not item[2].done():
+                item[2].set_result(False)
+
+    def notify(self, client: "Client"):
+        """Client got new command. Evict idle connection if client waits slot."""
+        if not (item := self.waiters.get(client)) or not client.commands:
+            return
+
+        source = item[0]
+        for active in self.active.get(source, ()):
+            if not active.commands and not active.evicted:
+                _LOGGER.debug("evict %s for %s", active.device, client.device)
+                self.evictions += 1
+                active.evict()
+                return
+
+    def idle(self, client: "Client"):
+        """Client sent all commands. Give slot to waiter with commands."""
+        source = get_source(client)
+        for waiter, item in self.waiters.items():
+            if item[0] == source and waiter.commands and not item[2].done():
+                _LOGGER.debug("evict %s for %s", client.device, waiter.device)
+                self.evictions += 1
+                client.evict()
+                return
+
+    def metrics(self) -> dict:
+        return {
+            "queue": len(self.waiters),
+            "active": {k: len(v) for k, v in self.active.items()},
+            "wait_time_max": round(max(self.wait_time, default=0), 2),
+            "wait_time_avg": round(
+                sum(self.wait_time) / len(self.wait_time) if self.wait_time else 0, 2
+            ),
+            "evictions": self.evictions,
+        }
+
+    def _has_waiters(self, source: str) -> bool:
+        return any(i[0] == source for i in self.waiters.values())
+
+    def _wakeup(self, source: str):
+        waiters = [
+            (not client.commands, seq, client, future)
+            for client, (src, seq, future) in self.waiters.items()
+            if src == source and not future.done()
+        ]
+        if not waiters or self.free_slots(source) <= 0:
+            return
+
+        # clients with commands first, than oldest
+        _, _, client, future = min(waiters, key=lambda i: i[:2])
+        self.active.setdefault(source, set()).add(client)
+        future.set_result(True)
+
+
+arbiter = Arbiter()
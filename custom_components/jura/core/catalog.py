@@ -0,0 +1,133 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import weakref
+from contextlib import suppress
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .parser import Products
+
+_LOGGER = logging.getLogger(__name__)
+
+RESOURCES = Path(__file__).parent / "resources.zip"
+CACHE = Path(__file__).parent / "resources.pickle"
+
+# compiled catalog layout depends on this code, so cache is invalid after update
+SOURCES = [Path(__file__).parent / i for i in ("catalog.py", "parser.py", "product.py")]
+
+_catalog: dict | None = None
+_lock = threading.Lock()
+
+# filename => products, unpickled on first use and shared while any device uses it
+_products: weakref.WeakValueDictionary[str, "Products"] = weakref.WeakValueDictionary()
+
+
+def fingerprint(path: Path) -> tuple:
+    stat = path.stat()
+    sources = hashlib.sha1()
+    for source in SOURCES:
+        sources.update(source.read_bytes())
+    return stat.st_size, stat.st_mtime_ns, sources.hexdigest()
+
+
+def compile_catalog(path: Path) -> dict:
+    """Scan resources zip once and build model_id index with parsed model XMLs."""
+    # only needed when cache is missing or outdated
+    from zipfile import ZipFile
+
+    from .parser import parse_model
+
+    machines: dict[int, tuple[str, str]] = {}
+    models: dict[str, dict] = {}
+
+    with ZipFile(path) as f:
+        # documents/xml/EF538/1.0.xml => EF538
+        xmls = {
+            i.filename.split("/")[2]: i.filename
+            for i in f.filelist
+            if i.filename.startswith("documents/xml/") and i.filename.endswith(".xml")
+        }
+
+        with f.open("JOE_MACHINES.TXT") as txt:
+            # first line is file date
+            for line in txt.read().decode().splitlines()[1:]:
+                items = line.split(";")
+                filename = xmls.get(items[2].upper())
+                if not items[0].isdigit() or not filename:
+                    continue
+                # same as old prefix search - first line wins
+                machines.setdefault(int(items[0]), (items[1], filename))
+
+        for _, filename in machines.values():
+            if filename in models:
+                continue
+            with f.open(filename) as xml:
+                model = parse_model(xml)._asdict()
+            # products are the biggest part, keep them pickled until used
+            model["products"] = pickle.dumps(model["products"], pickle.HIGHEST_PROTOCOL)
+            models[filename] = model
+
+    return {"fingerprint": fingerprint(path), "machines": machines, "models": models}
+
+
+def load_catalog() -> dict:
+    """Load compiled catalog from cache file or compile it on first run."""
+    global _catalog
+
+    if _catalog is None:
+        # executor threads resolving different models compile catalog only once
+        with _lock:
+            if _catalog is None:
+                _catalog = read_catalog()
+
+    return _catalog
+
+
+def read_catalog() -> dict:
+    try:
+        with CACHE.open("rb") as f:
+            catalog = pickle.load(f)
+        if catalog["fingerprint"] == fingerprint(RESOURCES):
+            return catalog
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        _LOGGER.debug("can't load catalog cache", exc_info=e)
+
+    catalog = compile_catalog(RESOURCES)
+    save_catalog(catalog)
+    return catalog
+
+
+def save_catalog(catalog: dict):
+    # write temp file and rename it, so crash can't leave truncated cache
+    from tempfile import NamedTemporaryFile
+
+    tmp = None
+    try:
+        with NamedTemporaryFile("wb", dir=CACHE.parent, delete=False) as f:
+            tmp = f.name
+            pickle.dump(catalog, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, CACHE)
+    except Exception as e:
+        # read-only install, catalog will be compiled again on each start
+        _LOGGER.warning("Can't save catalog cache: %s", e)
+        if tmp:
+            with suppress(OSError):
+                os.unlink(tmp)
+
+
+def get_model(model_id: int) -> dict | None:
+    catalog = load_catalog()
+    if machine := catalog["machines"].get(model_id):
+        model, filename = machine
+        data = catalog["models"][filename]
+        with _lock:
+            if (products := _products.get(filename)) is None:
+                products = _products[filename] = pickle.loads(data["products"])
+        return {"model_id": model_id, "model": model, **data, "products": products}
+    return None
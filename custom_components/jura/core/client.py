@@ -1,36 +1,128 @@
 import asyncio
 import logging
-import time
+import random
+from collections import deque
+from functools import lru_cache
 from typing import Callable
 
 from bleak import BLEDevice, BleakClient, BleakError
 from bleak_retry_connector import establish_connection
 
 from . import encryption
+from .arbiter import arbiter
+from .metrics import Histogram
 
 _LOGGER = logging.getLogger(__name__)
 
 ACTIVE_TIME = 120
 COMMAND_TIME = 15
+COMMAND_QUEUE = 10
+
+# keepalive interval adapts between min and max depending on link stability
+KEEPALIVE_MIN = 5
+KEEPALIVE_MAX = 15
+KEEPALIVE_TIME = 10
+
+# reconnect delay for error class: (base, max) seconds, doubles on each failure
+BACKOFF = {None: (1, 1), "timeout": (2, 60), "bleak": (1, 30), "other": (5, 120)}
+# consecutive failures before client waits for next advertisement
+CIRCUIT_FAILURES = 5
+
+UUID_KEY = "5a401531-ab2e-2548-c435-08c300000710"
+UUID_STATUS = "5a401524-ab2e-2548-c435-08c300000710"
+UUID_PRODUCT = "5a401525-ab2e-2548-c435-08c300000710"
+UUID_STATS_COMMAND = "5a401533-ab2e-2548-c435-08c300000710"
+UUID_STATS_DATA = "5a401534-ab2e-2548-c435-08c300000710"
+
+# time for machine to prepare statistics data after request, seconds
+STATS_WAIT = 1
+
+
+class Command:
+    __slots__ = ("data", "future", "start", "deadline", "idempotent", "timer")
+
+    def __init__(
+        self,
+        data: bytes,
+        future: asyncio.Future,
+        start: float,
+        timeout: float,
+        idempotent: bool,
+    ):
+        self.data = data
+        self.future = future
+        self.start = start
+        self.deadline = start + timeout
+        self.idempotent = idempotent
+        self.timer: asyncio.TimerHandle | None = None
 
 
 class Client:
-    def __init__(self, device: BLEDevice, callback: Callable = None):
+    def __init__(
+        self,
+        device: BLEDevice,
+        callback: Callable = None,
+        status_callback: Callable = None,
+        device_callback: Callable = None,
+        stats_callback: Callable = None,
+    ):
         self.device = device
+        # adapter or proxy of device, None - unknown
+        self.source: str | None = None
         self.callback = callback
+        self.status_callback = status_callback
+        self.device_callback = device_callback
+        self.stats_callback = stats_callback
 
         self.client: BleakClient | None = None
         self.loop = asyncio.get_running_loop()
 
-        self.ping_future: asyncio.Future | None = None
         self.ping_task: asyncio.Task | None = None
         self.ping_time = 0
 
-        self.send_data = None
-        self.send_time = 0
+        # time from connection request to ready connection, seconds
+        self.connect_start = 0
+        self.connect_latency: float | None = None
+
+        # single rearmable timer for keepalive, commands wake loop immediately
+        self.wakeup = asyncio.Event()
+        self.wakeup_time = 0
+        self.wakeup_timer: asyncio.TimerHandle | None = None
+        self.keepalive = KEEPALIVE_TIME
+
+        self.commands: deque[Command] = deque()
+        # command in write_gatt_char, finished by write result, not by deadline
+        self.writing: Command | None = None
+
+        self.key: int | None = None
+        self.status_notify = False
+
+        # statistics mode => loop time, read during next session after this time
+        self.stats_due: dict[int, float] = {}
+
+        # connection slot was requested by other client
+        self.evicted = False
+
+        # consecutive failures, circuit breaker and reconnect counters
+        self.failures = 0
+        self.parked = False
+        self.connects = 0
+        self.errors = {"timeout": 0, "bleak": 0, "other": 0}
+
+        # establish_connection, keepalive read and command write durations,
+        # send() to confirmed write latency
+        self.timings = {
+            "connect": Histogram(),
+            "keepalive": Histogram(),
+            "write": Histogram(),
+            "send": Histogram(),
+        }
 
     def ping(self):
-        self.ping_time = time.time() + ACTIVE_TIME
+        self.ping_time = self.loop.time() + ACTIVE_TIME
+
+        if not self.client and not self.connect_start:
+            self.connect_start = self.loop.time()
 
         if not self.ping_task:
             self.ping_task = self.loop.create_task(self._ping_loop())
@@ -38,73 +130,294 @@ class Client:
     def ping_cancel(self):
         # stop ping time
         self.ping_time = 0
+        self.connect_start = 0
+
+        # stop waiting connection slot
+        arbiter.cancel(self)
 
-        # cancel ping sleep timer
-        if self.ping_future:
-            self.ping_future.cancel()
+        # wake up heartbeat loop
+        self.wakeup.set()
 
-    def send(self, data: bytes):
-        # if send loop active - we change sending data
-        self.send_time = time.time() + COMMAND_TIME
-        self.send_data = data
+    def advertised(self):
+        # machine is reachable again - close circuit breaker
+        if self.parked:
+            self.wakeup.set()
+
+    def evict(self):
+        # close connection and wait for free slot again
+        self.evicted = True
+        self.wakeup.set()
+
+    def send(
+        self, data: bytes, timeout: float = COMMAND_TIME, idempotent: bool = False
+    ) -> asyncio.Future:
+        """Queue command. Returned future is done after successful write or
+        fails with TimeoutError after deadline. Idempotent commands with same
+        data share one queue entry.
+        """
+        if idempotent:
+            for cmd in self.commands:
+                if cmd.idempotent and cmd.data == data:
+                    return cmd.future
+
+        future = self.loop.create_future()
+
+        if len(self.commands) >= COMMAND_QUEUE:
+            future.set_exception(asyncio.QueueFull())
+            return future
+
+        cmd = Command(bytes(data), future, self.loop.time(), timeout, idempotent)
+        # fail on deadline while connecting, waiting slot or in backoff
+        cmd.timer = self.loop.call_at(cmd.deadline, self._expire_command, cmd)
+        self.commands.append(cmd)
 
         # refresh ping time
         self.ping()
 
-        # cancel ping sleep timer
-        if self.ping_future:
-            self.ping_future.cancel()
+        # raise priority in connection slots queue
+        arbiter.notify(self)
+
+        # wake up heartbeat loop
+        self.wakeup.set()
+
+        return future
+
+    def request_stats(self, mode: int, delay: float = 0):
+        """Schedule statistics read. Doesn't open connection by itself."""
+        due = self.loop.time() + delay if delay else 0
+        if mode not in self.stats_due or due < self.stats_due[mode]:
+            self.stats_due[mode] = due
+
+    def prepare(self, data: bytes):
+        """Pre-encrypt command with last known session key."""
+        if self.key is not None:
+            encrypt(bytes(data), self.key)
+
+    def _expire_command(self, cmd: Command):
+        if cmd is self.writing:
+            return
+        if cmd in self.commands:
+            self.commands.remove(cmd)
+        if not cmd.future.done():
+            cmd.future.set_exception(TimeoutError())
+
+    def _expire_commands(self, now: float):
+        # also drop commands cancelled by caller
+        for cmd in list(self.commands):
+            if cmd.future.done() or now >= cmd.deadline:
+                cmd.timer.cancel()
+                self._expire_command(cmd)
+
+    async def _send_commands(self):
+        self._expire_commands(self.loop.time())
+
+        while self.commands:
+            cmd = self.commands[0]
+            # on error command stays in queue and will be retried after reconnect
+            ts = self.loop.time()
+            self.writing = cmd
+            try:
+                await self.client.write_gatt_char(
+                    UUID_PRODUCT, data=encrypt(cmd.data, self.key), response=True
+                )
+            finally:
+                self.writing = None
+            self.timings["write"].add(self.loop.time() - ts)
+            self.commands.popleft()
+            cmd.timer.cancel()
+            self.timings["send"].add(self.loop.time() - cmd.start)
+            if not cmd.future.done():
+                cmd.future.set_result(True)
+
+    async def _read_stats(self):
+        now = self.loop.time()
+        for mode in [k for k, v in self.stats_due.items() if v <= now]:
+            data = bytes([self.key, 0, mode, 0xFF, 0xFF])
+            await self.client.write_gatt_char(
+                UUID_STATS_COMMAND,
+                data=encryption.encdec(data, self.key),
+                response=True,
+            )
+
+            # send new commands while machine prepares data
+            ready = self.loop.time() + STATS_WAIT
+            while (delay := ready - self.loop.time()) > 0:
+                await self._sleep(delay)
+                if self.commands:
+                    await self._send_commands()
+                if self.evicted or self.loop.time() >= self.ping_time:
+                    return  # mode stays scheduled for next session
+
+            data = await self.client.read_gatt_char(UUID_STATS_DATA)
+            # on error mode stays scheduled and will be read in next session
+            self.stats_due.pop(mode, None)
+            self.stats_callback(mode, encryption.encdec(data, self.key))
+
+    def _wakeup_at(self, when: float):
+        self.wakeup_time = when
+
+        if self.wakeup_timer:
+            if self.wakeup_timer.when() <= when:
+                return  # timer will rearm itself
+            self.wakeup_timer.cancel()
+
+        self.wakeup_timer = self.loop.call_at(when, self._wakeup_timer)
+
+    def _wakeup_timer(self):
+        if self.loop.time() < self.wakeup_time:
+            self.wakeup_timer = self.loop.call_at(self.wakeup_time, self._wakeup_timer)
+        else:
+            self.wakeup_timer = None
+            self.wakeup.set()
+
+    async def _sleep(self, delay: float):
+        """Sleep for delay seconds or until wakeup."""
+        if not self.wakeup.is_set():
+            self._wakeup_at(self.loop.time() + delay)
+            await self.wakeup.wait()
+        self.wakeup.clear()
 
     async def _ping_loop(self):
-        while time.time() < self.ping_time:
+        while self.loop.time() < self.ping_time:
+            # refresh BLEDevice from the best adapter or proxy
+            if self.device_callback and (device := self.device_callback()):
+                self.device = device
+
+            if not await arbiter.acquire(self):
+                continue
+
+            if self.loop.time() >= self.ping_time:
+                # window is over while slot was given, don't connect for nothing
+                arbiter.release(self)
+                continue
+
+            error = None
             try:
+                self.evicted = False
+                ts = self.loop.time()
                 self.client = await establish_connection(
                     BleakClient, self.device, self.device.address
                 )
+                self.timings["connect"].add(self.loop.time() - ts)
+                self.connects += 1
+                self.failures = 0
+                if self.connect_start:
+                    self.connect_latency = self.loop.time() - self.connect_start
+                    self.connect_start = 0
+
                 if self.callback:
                     self.callback(True)
 
+                if self.status_callback:
+                    await self._status_subscribe()
+
                 # heartbeat loop
-                while time.time() < self.ping_time:
+                while self.loop.time() < self.ping_time and not self.evicted:
                     # important dummy read for keep connection
-                    data = await self.client.read_gatt_char(
-                        "5a401531-ab2e-2548-c435-08c300000710"
-                    )
-                    key = data[0]
-
-                    if self.send_data:
-                        if time.time() < self.send_time:
-                            await self.client.write_gatt_char(
-                                "5a401525-ab2e-2548-c435-08c300000710",
-                                data=encrypt(self.send_data, key),
-                                response=True,
-                            )
-                        self.send_data = None
-
-                    # asyncio.sleep(10) with cancel
-                    self.ping_future = self.loop.create_future()
-                    self.loop.call_later(10, self.ping_future.cancel)
-                    try:
-                        await self.ping_future
-                    except asyncio.CancelledError:
-                        pass
+                    ts = self.loop.time()
+                    data = await self.client.read_gatt_char(UUID_KEY)
+                    self.timings["keepalive"].add(self.loop.time() - ts)
+                    self.key = data[0]
+
+                    if self.status_callback and not self.status_notify:
+                        data = await self.client.read_gatt_char(UUID_STATUS)
+                        self._status_update(None, data)
+
+                    if self.commands:
+                        await self._send_commands()
+                        arbiter.idle(self)
+
+                    if self.stats_callback and self.stats_due:
+                        await self._read_stats()
+
+                    await self._sleep(self.keepalive)
+
+                    # stable link - rarer keepalive
+                    self.keepalive = min(self.keepalive + 1, KEEPALIVE_MAX)
 
                 await self.client.disconnect()
             except TimeoutError:
-                pass
+                error = "timeout"
             except BleakError as e:
+                error = "bleak"
                 _LOGGER.debug("ping error", exc_info=e)
+                # unstable link - more frequent keepalive
+                self.keepalive = max(self.keepalive / 2, KEEPALIVE_MIN)
             except Exception as e:
-                _LOGGER.warning("ping error", exc_info=e)
+                error = "other"
+                # don't spam logs with the same error on each reconnect
+                _LOGGER.log(
+                    logging.DEBUG if self.failures else logging.WARNING,
+                    "ping error",
+                    exc_info=e,
+                )
             finally:
+                if error and self.client:
+                    # don't leave half-open connection after error
+                    try:
+                        await self.client.disconnect()
+                    except Exception:
+                        pass
                 self.client = None
+                arbiter.release(self)
                 if self.callback:
                     self.callback(False)
-                await asyncio.sleep(1)
+                self._expire_commands(self.loop.time())
+
+            if error:
+                self.errors[error] += 1
+                self.failures += 1
 
+            await self._backoff(error)
+
+        # ping time is over - drop all pending commands
+        self._expire_commands(float("inf"))
+
+        # next window measures its own latency
+        self.connect_start = 0
         self.ping_task = None
 
+    async def _backoff(self, error: str | None):
+        if self.failures >= CIRCUIT_FAILURES:
+            _LOGGER.debug("wait advertisement %s", self.device.address)
+            self.parked = True
+            # also wake on pending command deadline for one more attempt
+            wakeup = min([self.ping_time] + [i.deadline for i in self.commands])
+            await self._sleep(wakeup - self.loop.time())
+            self.parked = False
+            # one more attempt before next parking
+            self.failures = CIRCUIT_FAILURES - 1
+            return
+
+        base, maximum = BACKOFF[error]
+        delay = min(base * 2 ** max(self.failures - 1, 0), maximum)
+        # jitter, so many clients don't reconnect at the same time
+        await self._sleep(random.uniform(delay / 2, delay))
+
+    async def _status_subscribe(self):
+        # status frames are encrypted with session key
+        data = await self.client.read_gatt_char(UUID_KEY)
+        self.key = data[0]
+
+        try:
+            await self.client.start_notify(UUID_STATUS, self._status_update)
+            self.status_notify = True
+        except BleakError as e:
+            # fallback to status read on each heartbeat
+            _LOGGER.debug("status notify error", exc_info=e)
+            self.status_notify = False
+
+        data = await self.client.read_gatt_char(UUID_STATUS)
+        self._status_update(None, data)
+
+    def _status_update(self, _, data: bytearray):
+        data = encryption.encdec(data, self.key)
+        # first byte of decrypted frame should be equal to session key
+        if data[0] == self.key:
+            self.status_callback(data)
+
 
+@lru_cache(maxsize=32)
 def encrypt(data: bytes, key: int) -> bytes:
     data = bytearray(data)
     data[0] = key
@@ -1,182 +1,535 @@
-from datetime import datetime, timezone
-from pathlib import Path
-from typing import Callable, TypedDict
-from zipfile import ZipFile
-
-import xmltodict
-from bleak import AdvertisementData, BLEDevice
-
-from .client import Client
-
-SELECTS = [
-    "product",  # 1
-    "grinder_ratio",  # 2
-    "coffee_strength",  # 3
-    "temperature",  # 7
+import asyncio
+import re
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import TYPE_CHECKING, Callable
+
+from . import catalog
+from .advertisement import parse_advertisement
+from .metrics import Histogram
+from .product import NUMBERS, SELECTS, Attribute, get_product_set
+
+if TYPE_CHECKING:
+    from bleak import AdvertisementData, BLEDevice
+
+    from .parser import Products
+
+# default timeout for waiting connection state, seconds
+CONNECT_TIMEOUT = 30
+
+# minimal interval between RSSI and last_seen updates, seconds
+RSSI_INTERVAL = 10
+
+# RSSI samples per adapter or proxy and max samples age, seconds
+RSSI_HISTORY = 10
+RSSI_WINDOW = 60
+
+# passive sensors from advertisement manufacturer data
+ADVERTISEMENT = [
+    "firmware",
+    "serial_number",
+    "machine_number",
+    "production_date",
+    "status_bits",
 ]
 
-NUMBERS = [
-    "water_amount",  # 4
-    "milk_amount",  # 5
-    "milk_foam_amount",  # 6
-    "bypass",  # 10
-    "milk_break",  # 11
-]
+# diagnostic sensor attr => timing histogram name
+TIMINGS = {
+    "connect_time": "connect",
+    "keepalive_latency": "keepalive",
+    "write_latency": "write",
+    "send_latency": "send",
+    "update_ble_time": "update_ble",
+}
 
+# statistics modes for 5a401533 command characteristic
+STATS_PRODUCTS = 0x01
+# not confirmed on hardware, read only for sensors enabled by user
+STATS_MAINTENANCE_COUNTERS = 0x04
+STATS_MAINTENANCE_PERCENTS = 0x08
 
-class Attribute(TypedDict, total=False):
-    options: list[str]
-    default: str
+# long refresh interval and delay after product start for statistics, seconds
+STATS_INTERVAL = 3600
+STATS_DELAY = 60
 
-    min: int
-    max: int
-    step: int
-    value: int
+# maintenance values change slowly, re-read them not often than this, seconds
+MAINTENANCE_TTL = 6 * 3600
 
-    is_on: bool
-    extra: dict
+# model_id => shared pending future or EmptyModel/UnsupportedModel result
+_machines: dict[int, asyncio.Future] = {}
 
 
 class Device:
-    def __init__(self, name: str, model: str, products: list, device: BLEDevice):
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        products: "Products",
+        device: "BLEDevice",
+        alerts: list = None,
+        counters: list = None,
+        maintenance: dict = None,
+        rssi_interval: float = RSSI_INTERVAL,
+        stats_interval: float = STATS_INTERVAL,
+    ):
         self.name = name
         self.model = model
         self.products = products
 
-        self.client = Client(device, self.set_connected)
+        # BLE stack is loaded with first device, not on integration import
+        from .client import Client
+
+        self.client = Client(
+            device,
+            self.set_connected,
+            self.update_status,
+            self.best_ble_device,
+            self.update_stats,
+        )
+
+        # source => BLEDevice and RSSI history (monotonic time, rssi)
+        self.ble_devices: dict[str, "BLEDevice"] = {}
+        self.rssi_history: dict[str, deque[tuple[float, int]]] = {}
 
         self.connected = False
+        self.connected_events = {True: asyncio.Event(), False: asyncio.Event()}
+        self.connected_events[False].set()
         self.conn_info = {"mac": device.address}
+        self.conn_info_time = 0
+        self.rssi_interval = rssi_interval
 
-        self.options = get_options(self.products)
+        # client timings and time spent in update_ble callback
+        self.timings = {**self.client.timings, "update_ble": Histogram()}
+
+        # shared between devices of the same model
+        product_set = get_product_set(products)
+        self.templates = product_set.templates
+        self.options = product_set.options
+        self.products_by_name = product_set.by_name
+        self.products_active = product_set.active
+        self.capabilities = product_set.capabilities
+        self.product_set = product_set
 
         self.product = None
+        self.template = None
         self.values = None
-        self.updates_connect: list = []
-        self.updates_product: list = []
+
+        # attr => handlers and last dispatched attribute value
+        self.updates: dict[str, list[Callable]] = {}
+        self.updates_value: dict[str, Attribute] = {}
+
+        # alert attr => (bit, name, type)
+        self.alerts: dict[str, tuple] = {}
+        self.alerts_bits: dict[int, str] = {}
+        for alert in alerts or []:
+            bit, name, _ = alert
+            attr = slug(name)
+            if attr not in self.alerts and bit not in self.alerts_bits:
+                self.alerts[attr] = alert
+                self.alerts_bits[bit] = attr
+
+        self.status: bytes | None = None
+
+        # counter attr => product code (0 - total), first product wins
+        self.counters: dict[str, int] = {}
+        for i, (code, name) in enumerate(counters or []):
+            attr = slug(name) if i == 0 else slug("counter " + name)
+            if attr not in self.counters and code not in self.counters.values():
+                self.counters[attr] = code
+        self.counter_values: dict[int, int] = {}
+
+        maintenance = maintenance or {}
+        self.thresholds: dict[str, int] = maintenance.get("thresholds", {})
+        self.lifetimes: dict[str, int] = maintenance.get("lifetimes", {})
+
+        # statistics mode => maintenance types in data order
+        self.maintenance_types = {
+            STATS_MAINTENANCE_COUNTERS: maintenance.get("counters", []),
+            STATS_MAINTENANCE_PERCENTS: maintenance.get("percents", []),
+        }
+        # maintenance attr => (statistics mode, maintenance type)
+        self.maintenance: dict[str, tuple[int, str]] = {}
+        for mode, suffix in (
+            (STATS_MAINTENANCE_COUNTERS, "_count"),
+            (STATS_MAINTENANCE_PERCENTS, "_percent"),
+        ):
+            for type_ in self.maintenance_types[mode]:
+                self.maintenance[type_slug(type_ + suffix)] = (mode, type_)
+        # due attr => maintenance type with lifetime in days
+        self.maintenance_due: dict[str, str] = {
+            type_slug(type_ + "_due"): type_
+            for type_ in self.lifetimes
+            if type_ in self.maintenance_types[STATS_MAINTENANCE_COUNTERS]
+        }
+        self.maintenance_values: dict[int, dict[str, int]] = {}
+        self.maintenance_time: dict[str, datetime] = {}
+
+        self.stats_interval = stats_interval
+        if self.counters:
+            self.client.request_stats(STATS_PRODUCTS)
+
+        # last parsed advertisement manufacturer data
+        self.adv_info: dict = {}
 
     @property
     def mac(self) -> str:
         return self.client.device.address
 
     def register_update(self, attr: str, handler: Callable):
-        if attr == "product":
-            return
-        elif attr == "connection":
-            self.updates_connect.append(handler)
-        else:
-            self.updates_product.append(handler)
+        self.updates.setdefault(attr, []).append(handler)
+
+    def dispatch(self, *attrs: str):
+        """Call handlers only for attributes with changed value."""
+        for attr in attrs:
+            if not (handlers := self.updates.get(attr)):
+                continue
+
+            value = self.attribute(attr)
+            if attr in self.updates_value and self.updates_value[attr] == value:
+                continue
+
+            self.updates_value[attr] = value
+            for handler in handlers:
+                handler()
+
+    def update_ble(
+        self,
+        advertisment: "AdvertisementData",
+        device: "BLEDevice" = None,
+        source: str = None,
+    ):
+        ts = time.perf_counter()
 
-    def update_ble(self, advertisment: AdvertisementData):
         self.conn_info["last_seen"] = datetime.now(timezone.utc)
         self.conn_info["rssi"] = advertisment.rssi
 
-        for handler in self.updates_connect:
-            handler()
+        now = time.monotonic()
+
+        if device:
+            if source is None and isinstance(device.details, dict):
+                source = device.details.get("source")
+            self.ble_devices[source] = device
+            if source not in self.rssi_history:
+                self.rssi_history[source] = deque(maxlen=RSSI_HISTORY)
+            self.rssi_history[source].append((now, advertisment.rssi))
+
+        self.client.advertised()
+
+        if (data := advertisment.manufacturer_data.get(171)) is not None:
+            self.update_adv(data)
+
+        # throttle frequent advertisements
+        if now - self.conn_info_time >= self.rssi_interval:
+            self.conn_info_time = now
+            self.dispatch("conn_info", *TIMINGS)
+
+        self.timings["update_ble"].add(time.perf_counter() - ts)
+
+    def update_adv(self, data: bytes):
+        info = parse_advertisement(data)
+        if info == self.adv_info:
+            return
+
+        self.adv_info = info
+
+        # session key from advertisement allows pre-encrypt commands without connection
+        if "key" in info and not self.client.client:
+            self.client.key = info["key"]
+
+        self.dispatch(*ADVERTISEMENT)
+
+    def best_ble_device(self) -> "BLEDevice | None":
+        """BLEDevice from adapter or proxy with best recent average RSSI."""
+        best, best_rssi = None, None
+        since = time.monotonic() - RSSI_WINDOW
+        for source, history in self.rssi_history.items():
+            samples = [rssi for ts, rssi in history if ts >= since]
+            if not samples:
+                continue
+            rssi = sum(samples) / len(samples)
+            if best_rssi is None or rssi > best_rssi:
+                best, best_rssi = source, rssi
+
+        if best is None:
+            return None
+
+        self.conn_info["source"] = best
+        # connection slots are counted per adapter or proxy
+        self.client.source = best
+        return self.ble_devices[best]
 
     def set_connected(self, connected: bool):
         self.connected = connected
+        self.connected_events[connected].set()
+        self.connected_events[not connected].clear()
+
+        if connected and self.client.connect_latency is not None:
+            self.conn_info["connect_latency"] = round(self.client.connect_latency, 2)
+        self.conn_info["connects"] = self.client.connects
+        self.conn_info["errors"] = self.client.errors.copy()
+        self.conn_info_time = time.monotonic()
+        self.dispatch("connection", "conn_info", *TIMINGS)
+
+        if not connected and self.status is not None:
+            # alerts are known only during session, don't show stale state
+            self.status = None
+            self.dispatch(*self.alerts)
+
+    async def wait_connected(
+        self, connected: bool = True, timeout: float = CONNECT_TIMEOUT
+    ) -> bool:
+        """Wait until connection state is equal to connected, False on timeout."""
+        try:
+            await asyncio.wait_for(self.connected_events[connected].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def update_status(self, data: bytes):
+        # first byte is key, next are alert bits (MSB first)
+        data = bytes(data[1:])
+        if data == self.status:
+            return
 
-        for handler in self.updates_connect:
-            handler()
+        size = len(data) * 8
+        new = int.from_bytes(data, "big")
+        if self.status is not None and len(self.status) * 8 == size:
+            changed = new ^ int.from_bytes(self.status, "big")
+        else:
+            changed = (1 << size) - 1  # first frame - update all alerts
+
+        self.status = data
+
+        while changed:
+            low = changed & -changed
+            changed ^= low
+            bit = size - low.bit_length()
+            if attr := self.alerts_bits.get(bit):
+                self.dispatch(attr)
+
+    def update_stats(self, mode: int, data: bytes):
+        if mode == STATS_PRODUCTS:
+            # 3 bytes big endian counter for each product code, 0xFFFFFF - no product
+            values = {}
+            for code in self.counters.values():
+                pos = code * 3
+                if pos + 3 > len(data):
+                    continue
+                if (value := int.from_bytes(data[pos : pos + 3], "big")) != 0xFFFFFF:
+                    values[code] = value
+            self.counter_values = values
+            self.dispatch(*self.counters)
+            self.client.request_stats(mode, self.stats_interval)
+            return
+
+        # 2 bytes big endian counters or 1 byte percents in type order, 0xFF.. - none
+        size = 2 if mode == STATS_MAINTENANCE_COUNTERS else 1
+        values = {}
+        for i, type_ in enumerate(self.maintenance_types.get(mode, [])):
+            if (i + 1) * size > len(data):
+                break
+            value = int.from_bytes(data[i * size : (i + 1) * size], "big")
+            if value != (1 << size * 8) - 1:
+                values[type_] = value
+
+        if mode == STATS_MAINTENANCE_COUNTERS:
+            # maintenance counter increased - maintenance was done right now
+            previous = self.maintenance_values.get(mode, {})
+            for type_, value in values.items():
+                if type_ in previous and value > previous[type_]:
+                    self.maintenance_time[type_] = datetime.now(timezone.utc)
+
+        self.maintenance_values[mode] = values
+        self.dispatch(
+            *[k for k, v in self.maintenance.items() if v[0] == mode],
+            *self.maintenance_due,
+        )
+        self.client.request_stats(mode, MAINTENANCE_TTL)
+
+    def request_maintenance(self, attr: str):
+        """Start reading maintenance mode used by enabled sensor."""
+        if attr in self.maintenance:
+            mode = self.maintenance[attr][0]
+        elif attr in self.maintenance_due:
+            mode = STATS_MAINTENANCE_COUNTERS
+        else:
+            return
+        if mode not in self.maintenance_values:
+            self.client.request_stats(mode)
+
+    def diagnostics(self) -> dict:
+        client = self.client
+        return {
+            "model": self.model,
+            "connected": self.connected,
+            "conn_info": self.conn_info.copy(),
+            "advertisement": self.adv_info.copy(),
+            "status": self.status.hex() if self.status is not None else None,
+            "client": {
+                "connects": client.connects,
+                "errors": client.errors.copy(),
+                "failures": client.failures,
+                "parked": client.parked,
+                "keepalive": client.keepalive,
+                "commands": len(client.commands),
+                "stats_due": list(client.stats_due),
+            },
+            "timings": {k: v.summary() for k, v in self.timings.items()},
+        }
 
     def selects(self) -> list[str]:
-        products = str(self.products).lower()
-        return [k for k in SELECTS if k in products]
+        return [k for k in SELECTS if k in self.capabilities]
 
     def numbers(self) -> list[str]:
-        products = str(self.products).lower()
-        return [k for k in NUMBERS if k in products]
+        return [k for k in NUMBERS if k in self.capabilities]
 
     def attribute(self, attr: str) -> Attribute:
         if attr == "connection":
-            return Attribute(is_on=self.connected, extra=self.conn_info)
+            return Attribute(is_on=self.connected)
+
+        if attr == "conn_info":
+            return Attribute(extra=self.conn_info.copy())
+
+        if attr in ADVERTISEMENT:
+            if attr not in self.adv_info:
+                return Attribute()
+            if attr == "production_date":
+                extra = {"uchi_date": self.adv_info["uchi_date"]}
+                return Attribute(value=self.adv_info[attr], extra=extra)
+            return Attribute(value=self.adv_info[attr])
+
+        if attr in TIMINGS:
+            timing = self.timings[TIMINGS[attr]]
+            if (value := timing.percentile(0.5)) is None:
+                return Attribute()
+            return Attribute(value=round(value * 1e3, 2), extra=timing.summary())
+
+        if attr in self.counters:
+            if (value := self.counter_values.get(self.counters[attr])) is None:
+                return Attribute()
+            return Attribute(value=value)
+
+        if attr in self.maintenance:
+            mode, type_ = self.maintenance[attr]
+            value = self.maintenance_values.get(mode, {}).get(type_)
+            if value is None:
+                return Attribute()
+            if mode == STATS_MAINTENANCE_PERCENTS and type_ in self.thresholds:
+                threshold = self.thresholds[type_]
+                extra = {"threshold": threshold, "required": value >= threshold}
+                return Attribute(value=value, extra=extra)
+            return Attribute(value=value)
+
+        if attr in self.maintenance_due:
+            type_ = self.maintenance_due[attr]
+            if not (ts := self.maintenance_time.get(type_)):
+                return Attribute()
+            return Attribute(value=ts + timedelta(days=self.lifetimes[type_]))
+
+        if attr in self.alerts:
+            if self.status is None:
+                return Attribute()
+            bit = self.alerts[attr][0]
+            if bit >= len(self.status) * 8:
+                return Attribute(is_on=False)
+            return Attribute(is_on=bool(self.status[bit // 8] & (0x80 >> bit % 8)))
 
         if attr == "product":
             return Attribute(
-                options=[
-                    i["@Name"] for i in self.products if i.get("@Active") != "false"
-                ],
-                default=self.product["@Name"] if self.product else None,
+                options=self.products_active,
+                default=self.product.name if self.product else None,
             )
 
-        attribute = self.product and self.product.get(attr.upper())
-        if not attribute:
+        if not self.template or attr not in self.template.attributes:
             return {"options": self.options[attr]} if attr in self.options else {}
 
-        if "@Value" in attribute:
-            return Attribute(
-                min=int(attribute["@Min"]),
-                max=int(attribute["@Max"]),
-                step=int(attribute["@Step"]),
-                value=int(attribute["@Value"]),
-            )
-
-        default = attribute["@Default"]
-        return Attribute(
-            options=[i["@Name"] for i in attribute["ITEM"]],
-            default=next(
-                i["@Name"] for i in attribute["ITEM"] if i["@Value"] == default
-            ),
-        )
+        return self.template.attributes[attr]
 
     def select_option(self, attr: str, option: str):
         if attr == "product":
             self.select_product(option)
             return
 
-        attribute = self.product and self.product.get(attr.upper())
-        if not attribute:
+        if not self.template or attr not in self.template.items:
             return None
 
-        value = next(i["@Value"] for i in attribute["ITEM"] if i["@Name"] == option)
-        self.set_value(attr, int(value, 16))
+        self.set_value(attr, self.template.items[attr][option])
 
     def set_value(self, attr: str, value: int):
         self.client.ping()
 
+        if slot := self.template.slots.get(attr):
+            slot.encode(value)  # raise ValueError on wrong value
+
         self.values[attr] = value
+        self.client.prepare(self.command())
+
+        # entity shows user's value now, so next product change should update it
+        self.updates_value.pop(attr, None)
 
     def select_product(self, product: str):
         self.client.ping()
 
-        self.product = next(i for i in self.products if i["@Name"] == product)
+        self.product = self.products_by_name[product]
+        self.template = self.templates[product]
         self.values = {}
 
-        # dispatch to all listeners
-        for handler in self.updates_product:
-            handler()
+        # dispatch to product listeners with changed attributes
+        self.dispatch(*SELECTS, *NUMBERS)
 
-    def start_product(self):
-        if self.product:
-            self.client.send(self.command())
+        self.client.prepare(self.command())
 
-    def command(self) -> bytes:
-        data = bytearray(18)
+    async def start_product(self):
+        if not self.product:
+            raise ValueError("Product not selected")
 
-        # set product
-        data[1] = int(self.product["@Code"], 16)
+        await self.send_product(self.command())
 
-        for attr in SELECTS + NUMBERS:
-            attribute = self.product and self.product.get(attr.upper())
-            if not attribute:
-                continue
+    async def send_product(self, data: bytes):
+        await self.client.send(data)
+        # counters will change after product is done
+        if self.counters:
+            self.client.request_stats(STATS_PRODUCTS, STATS_DELAY)
+
+    def product_command(self, product: str, options: dict[str, str | int]) -> bytes:
+        """Build command for product with select option names and number values
+        without changing selected product. Raise ValueError on wrong options.
+        """
+        # inactive products exist in model file, but machine doesn't make them
+        if product not in self.products_active:
+            raise ValueError(f"Unknown product: {product}")
+
+        template = self.templates[product]
+        data = bytearray(template.frame)
+
+        for attr, option in options.items():
+            if not (slot := template.slots.get(attr)):
+                raise ValueError(f"Product {product} has no {attr}")
 
-            if attr in self.values:
-                # set user's value
-                value = self.values[attr]
-            elif "@Value" in attribute:
-                # set default int value
-                value = int(attribute["@Value"])
+            if attr in template.items:
+                if option not in template.items[attr]:
+                    raise ValueError(f"Wrong {attr}: {option}")
+                value = template.items[attr][option]
             else:
-                # set default list value
-                value = int(attribute["@Default"], 16)
+                value = int(option)
 
-            if step := int(attribute.get("@Step", 0)):
-                value = int(value / step)
+            data[slot.pos] = slot.encode(value)
 
-            pos = int(attribute["@Argument"][1:])
-            data[pos] = value
+        return data
+
+    async def make_product(self, product: str, options: dict[str, str | int]):
+        """Raise ValueError on wrong options before command is queued."""
+        await self.send_product(self.product_command(product, options))
+
+    def command(self) -> bytes:
+        data = bytearray(self.template.frame)
+
+        # set user's values
+        for attr, value in self.values.items():
+            if slot := self.template.slots.get(attr):
+                data[slot.pos] = slot.encode(value)
 
         # additional data (some unknown)
         # data[0] = self.key
@@ -187,6 +540,18 @@ class Device:
         return data
 
 
+# cached, so devices of the same model share attribute strings
+@lru_cache(maxsize=1024)
+def slug(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+
+
+@lru_cache(maxsize=256)
+def type_slug(name: str) -> str:
+    # FilterChange => filter_change
+    return slug(re.sub(r"(?<=[a-z])(?=[A-Z])", " ", name))
+
+
 class EmptyModel(Exception):
     pass
 
@@ -195,43 +560,42 @@ class UnsupportedModel(Exception):
     pass
 
 
-def get_machine(adv: bytes) -> dict | None:
-    model_id = int.from_bytes(adv[4:6], "little")
-    if model_id == 0:
-        raise EmptyModel()
+def get_model_id(adv: bytes) -> int:
+    return int.from_bytes(adv[4:6], "little")
 
-    path = Path(__file__).parent / "resources.zip"
-    with ZipFile(path) as f:
-        prefix = str(model_id).encode()
-        with f.open("JOE_MACHINES.TXT") as txt:
-            try:
-                line = next(i for i in txt.readlines() if i.startswith(prefix))
-            except StopIteration:
-                raise UnsupportedModel(model_id)
-            items = line.decode().split(";")
-
-        dirname = f"documents/xml/{items[2].upper()}/"
-        filename = next(
-            i.filename
-            for i in f.filelist
-            if i.filename.startswith(dirname) and i.filename.endswith(".xml")
-        )
 
-        with f.open(filename) as xml:
-            raw = xmltodict.parse(xml.read())
-            products = raw["JOE"]["PRODUCTS"]["PRODUCT"]
+def get_machine(adv: bytes) -> dict | None:
+    return get_machine_by_id(get_model_id(adv))
 
-    return {"model": items[1], "products": products}
 
+def get_machine_by_id(model_id: int) -> dict | None:
+    if model_id == 0:
+        raise EmptyModel()
 
-def get_options(products: list[dict]) -> dict[str, list]:
-    return {
-        attr: list(
-            {
-                option["@Name"]: None
-                for product in products
-                for option in product.get(attr.upper(), {}).get("ITEM", [])
-            }.keys()  # unique keys with save order
-        )
-        for attr in SELECTS
-    }
+    if not (machine := catalog.get_model(model_id)):
+        raise UnsupportedModel(model_id)
+
+    return machine
+
+
+def async_get_machine(model_id: int) -> asyncio.Future:
+    """Resolve machine in executor. Concurrent and repeated calls for the same
+    model_id share one future, so failed models don't load resources again.
+    """
+    if future := _machines.get(model_id):
+        return future
+
+    def forget(fut: asyncio.Future):
+        # retry on next advertisement after unexpected errors, resolved machine
+        # is owned by devices, so catalog can release products after them
+        if fut.cancelled() or not isinstance(
+            fut.exception(), (EmptyModel, UnsupportedModel)
+        ):
+            _machines.pop(model_id, None)
+
+    future = asyncio.get_running_loop().run_in_executor(
+        None, get_machine_by_id, model_id
+    )
+    future.add_done_callback(forget)
+    _machines[model_id] = future
+    return future
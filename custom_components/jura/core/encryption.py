@@ -1,6 +1,12 @@
+from functools import lru_cache
+
 NUMB1 = [14, 4, 3, 2, 1, 13, 8, 11, 6, 15, 12, 7, 10, 5, 0, 9]
 NUMB2 = [10, 6, 13, 12, 14, 11, 1, 9, 15, 7, 0, 5, 3, 2, 4, 8]
 
+# nibble counter affects result only by its lower 8 bits, so every byte position
+# repeats after 128 bytes
+POSITIONS = 128
+
 
 def mod256(i: int):
     return i % 256
@@ -14,17 +20,63 @@ def shuffle(src: int, cnt: int, key1: int, key2: int) -> int:
     return mod256(i4 - cnt - key1) % 16
 
 
+@lru_cache(maxsize=1)
+def get_numpy():
+    """Optional NumPy, imported on first batch because it is slow to import."""
+    try:
+        import numpy
+
+        return numpy
+    except ImportError:
+        return None
+
+
+class Table:
+    """Byte lookup rows for key, row for byte position is built on first use,
+    because frames are short and most of 128 positions are never used.
+    """
+
+    __slots__ = ("key1", "key2", "rows")
+
+    def __init__(self, key: int):
+        self.key1 = key >> 4
+        self.key2 = key & 0xF
+        self.rows: list[bytes | None] = [None] * POSITIONS
+
+    def row(self, pos: int) -> bytes:
+        if (row := self.rows[pos]) is None:
+            key1, key2 = self.key1, self.key2
+            hi = [shuffle(src, pos * 2, key1, key2) << 4 for src in range(16)]
+            lo = [shuffle(src, pos * 2 + 1, key1, key2) for src in range(16)]
+            row = self.rows[pos] = bytes(a | b for a in hi for b in lo)
+        return row
+
+
+@lru_cache(maxsize=32)
+def get_table(key: int) -> Table:
+    return Table(key)
+
+
 def encdec(src: bytes | bytearray, key: int) -> bytes:
-    dst = b""
-    key1 = key >> 4
-    key2 = key & 0xF
-    cnt = 0
-    for b in src:
-        src1 = b >> 4
-        src2 = b & 0xF
-        dst1 = shuffle(src1, cnt, key1, key2)
-        cnt += 1
-        dst2 = shuffle(src2, cnt, key1, key2)
-        cnt += 1
-        dst += bytes([(dst1 << 4) | dst2])
-    return dst
+    table = get_table(key)
+    rows = table.rows
+    dst = bytearray(len(src))
+    for i, b in enumerate(src):
+        pos = i % POSITIONS
+        dst[i] = (rows[pos] or table.row(pos))[b]
+    return bytes(dst)
+
+
+def encdec_batch(frames: list[bytes], key: int) -> list[bytes]:
+    """Decode many frames with same key, vectorized with NumPy if available."""
+    np = get_numpy()
+    if np is None or len({len(i) for i in frames}) != 1:
+        return [encdec(i, key) for i in frames]
+
+    table = get_table(key)
+    size = len(frames[0])
+    rows = b"".join(table.row(pos) for pos in range(min(size, POSITIONS)))
+    rows = np.frombuffer(rows, dtype=np.uint8)
+    data = np.frombuffer(b"".join(frames), dtype=np.uint8).reshape(len(frames), -1)
+    offset = (np.arange(size) % POSITIONS) << 8
+    return [i.tobytes() for i in rows[offset + data]]
@@ -0,0 +1,52 @@
+from bisect import bisect_left
+from collections import deque
+
+# histogram bucket upper bounds, seconds
+BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    """Bounded timing stats: bucket counts for all samples and ring buffer with
+    last samples for percentiles.
+    """
+
+    __slots__ = ("buckets", "samples", "count", "total")
+
+    def __init__(self, size: int = 100):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.samples: deque[float] = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float):
+        self.buckets[bisect_left(BUCKETS, value)] += 1
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def percentile(self, q: float) -> float | None:
+        if not self.samples:
+            return None
+        samples = sorted(self.samples)
+        return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+    def summary(self) -> dict:
+        """All times in milliseconds, percentiles are for last samples."""
+        if not self.count:
+            return {"count": 0}
+
+        def ms(value: float) -> float:
+            return round(value * 1e3, 2)
+
+        return {
+            "count": self.count,
+            "avg": ms(self.total / self.count),
+            "p50": ms(self.percentile(0.5)),
+            "p95": ms(self.percentile(0.95)),
+            "max": ms(max(self.samples)),
+            "buckets": {
+                f"le_{b}s" if b is not None else "inf": n
+                for b, n in zip(BUCKETS + (None,), self.buckets)
+                if n
+            },
+        }
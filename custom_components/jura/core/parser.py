@@ -0,0 +1,158 @@
+from collections.abc import Iterable, Sequence
+from sys import intern
+from typing import BinaryIO, NamedTuple
+from xml.parsers import expat
+
+from .product import NUMBERS, SELECTS
+
+# product settings tags used by integration, other subtrees are skipped
+SETTINGS = {attr.upper(): attr for attr in SELECTS + NUMBERS if attr != "product"}
+
+
+class Option(NamedTuple):
+    name: str
+    value: int
+
+
+class Setting(NamedTuple):
+    pos: int  # byte in command from Argument="F4"
+    step: int
+    min: int | None
+    max: int | None
+    value: int | None  # default for number settings
+    default: int | None  # default option value for select settings
+    items: tuple[Option, ...] | None  # options for select settings
+
+
+class Product(NamedTuple):
+    code: int
+    name: str
+    active: bool
+    settings: dict[str, Setting | None]  # attr => setting, None for empty tag
+
+
+class Products(Sequence):
+    """Immutable products of one model. Unlike plain tuple supports weak
+    references, so catalog can share it between devices while it is used.
+    """
+
+    __slots__ = ("items", "__weakref__")
+
+    def __init__(self, items: Iterable[Product]):
+        self.items = tuple(items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class Model(NamedTuple):
+    products: Products
+    counters: list[tuple[int, str]]  # (code, name), total goes first
+    alerts: list[tuple[int, str, str | None]]  # (bit, name, type)
+    maintenance: dict
+
+
+def parse_model(f: BinaryIO) -> Model:
+    """Stream model XML and extract only parts used by integration."""
+    products = []
+    counters = []
+    alerts = []
+    maintenance = {"counters": [], "percents": [], "thresholds": {}, "lifetimes": {}}
+
+    stack = []  # parent tags
+    product: dict | None = None
+    setting: tuple | None = None  # (tag, attrs, items)
+    bank: list | None = None
+    shared: dict[Setting, Setting] = {}
+
+    def start(tag: str, attrs: dict):
+        nonlocal product, setting, bank
+
+        parent = stack[-1] if stack else None
+        stack.append(tag)
+
+        if parent == "PRODUCTS":
+            if tag == "PRODUCT":
+                product = {
+                    "code": int(attrs["Code"], 16),
+                    "name": intern(attrs["Name"]),
+                    "active": attrs.get("Active") != "false",
+                    "settings": {},
+                }
+                counters.append((product["code"], product["name"]))
+            elif tag == "TOTALCOUNTER":
+                counters.insert(0, (int(attrs["Code"], 16), attrs["Name"]))
+        elif parent == "PRODUCT" and product is not None:
+            if tag in SETTINGS:
+                setting = (tag, attrs, [])
+        elif tag == "ITEM" and setting is not None and parent == setting[0]:
+            setting[2].append(Option(intern(attrs["Name"]), int(attrs["Value"], 16)))
+        elif parent == "ALERTS" and tag == "ALERT":
+            alerts.append((int(attrs["Bit"]), attrs["Name"], attrs.get("Type")))
+        elif parent == "MAINTENANCEPAGE" and tag == "BANK":
+            if attrs.get("Name") == "Maintenance Counter":
+                bank = maintenance["counters"]
+            elif attrs.get("Name") == "Maintenance Percent":
+                bank = maintenance["percents"]
+        elif parent == "BANK" and tag == "TEXTITEM" and bank is not None:
+            bank.append(attrs["Type"])
+        elif parent == "PREDICTIVEMAINTENANCE" and tag == "PREDICTIVEBUTTON":
+            maintenance["thresholds"][attrs["Name"]] = int(attrs["Threshold"])
+        elif parent == "MAINTENANCELIFETIME" and tag == "LIFETIME":
+            maintenance["lifetimes"][attrs["Name"]] = int(attrs["Lifetime"])
+
+    def end(tag: str):
+        nonlocal product, setting, bank
+
+        stack.pop()
+
+        if setting is not None and tag == setting[0]:
+            _, attrs, items = setting
+            item = compile_setting(attrs, items)
+            # same settings are common for products of one model
+            product["settings"][SETTINGS[tag]] = shared.setdefault(item, item)
+            setting = None
+        elif tag == "PRODUCT" and product is not None:
+            products.append(Product(**product))
+            product = None
+        elif tag == "BANK":
+            bank = None
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.ParseFile(f)
+
+    return Model(Products(products), counters, alerts, maintenance)
+
+
+def compile_setting(attrs: dict, items: list[Option]) -> Setting | None:
+    if not attrs and not items:
+        return None
+
+    pos = int(attrs["Argument"][1:])
+    step = int(attrs.get("Step", 0))
+
+    if "Value" in attrs:
+        return Setting(
+            pos=pos,
+            step=step,
+            min=int(attrs["Min"]),
+            max=int(attrs["Max"]),
+            value=int(attrs["Value"]),
+            default=None,
+            items=None,
+        )
+
+    return Setting(
+        pos=pos,
+        step=step,
+        min=None,
+        max=None,
+        value=None,
+        default=int(attrs["Default"], 16),
+        items=tuple(items),
+    )
@@ -0,0 +1,176 @@
+import weakref
+from datetime import date
+from typing import TYPE_CHECKING, NamedTuple, TypedDict
+
+if TYPE_CHECKING:
+    from .parser import Product, Products
+
+SELECTS = [
+    "product",  # 1
+    "grinder_ratio",  # 2
+    "coffee_strength",  # 3
+    "temperature",  # 7
+]
+
+NUMBERS = [
+    "water_amount",  # 4
+    "milk_amount",  # 5
+    "milk_foam_amount",  # 6
+    "bypass",  # 10
+    "milk_break",  # 11
+]
+
+
+class Attribute(TypedDict, total=False):
+    options: list[str]
+    default: str
+
+    min: int
+    max: int
+    step: int
+    value: int | str | date
+
+    is_on: bool
+    extra: dict
+
+
+class Slot(NamedTuple):
+    pos: int
+    step: int
+    min: int
+    max: int
+    values: frozenset | None  # allowed values for select attributes
+
+    def encode(self, value: int) -> int:
+        if self.values is not None:
+            if value not in self.values:
+                raise ValueError(f"Wrong value: {value}")
+        elif not self.min <= value <= self.max:
+            raise ValueError(f"Value {value} out of range {self.min}..{self.max}")
+        elif self.step and value % self.step:
+            raise ValueError(f"Value {value} not multiple of {self.step}")
+
+        return int(value / self.step) if self.step else value
+
+
+class Template(NamedTuple):
+    frame: bytes  # default 18 bytes command
+    slots: dict[str, Slot]
+    attributes: dict[str, Attribute]  # default attributes for entities
+    items: dict[str, dict[str, int]]  # select attr => option name => value
+
+
+def compile_product(product: "Product") -> Template:
+    data = bytearray(18)
+
+    # set product
+    data[1] = product.code
+
+    slots = {}
+    attributes = {}
+    items = {}
+
+    for attr in SELECTS + NUMBERS:
+        if not (setting := product.settings.get(attr)):
+            continue
+
+        step = setting.step
+
+        if setting.items is None:
+            # default int value
+            slot = Slot(
+                pos=setting.pos,
+                step=step,
+                min=setting.min,
+                max=setting.max,
+                values=None,
+            )
+            value = setting.value
+            attributes[attr] = Attribute(
+                min=slot.min, max=slot.max, step=step, value=value
+            )
+        else:
+            # default list value
+            values = frozenset(i.value for i in setting.items)
+            slot = Slot(
+                pos=setting.pos,
+                step=step,
+                min=min(values),
+                max=max(values),
+                values=values,
+            )
+            value = setting.default
+            # first item wins for duplicated names
+            items[attr] = {i.name: i.value for i in reversed(setting.items)}
+            attributes[attr] = Attribute(
+                options=[i.name for i in setting.items],
+                default=next(
+                    (i.name for i in setting.items if i.value == setting.default),
+                    None,  # wrong default in some XMLs
+                ),
+            )
+
+        data[slot.pos] = int(value / step) if step else value
+        slots[attr] = slot
+
+    return Template(frame=bytes(data), slots=slots, attributes=attributes, items=items)
+
+
+class ProductSet:
+    """Products with derived data, shared by all devices of the same model."""
+
+    __slots__ = (
+        "products",
+        "templates",
+        "options",
+        "by_name",
+        "active",
+        "capabilities",
+        "__weakref__",
+    )
+
+    def __init__(self, products: "Products"):
+        # keep reference to products, so id can't be reused while set is alive
+        self.products = products
+        # first product wins for duplicated names
+        self.by_name: dict[str, "Product"] = {}
+        for product in reversed(products):
+            self.by_name[product.name] = product
+        self.templates = {i.name: compile_product(i) for i in self.by_name.values()}
+        self.options = get_options(products)
+        self.active = [i.name for i in products if i.active]
+        self.capabilities = frozenset(
+            {"product"}
+            | {
+                attr
+                for i in products
+                for attr in SELECTS + NUMBERS
+                if attr in i.settings
+            }
+        )
+
+
+# id(products) => ProductSet, alive while any device of the model uses it
+_product_sets: weakref.WeakValueDictionary[int, ProductSet] = (
+    weakref.WeakValueDictionary()
+)
+
+
+def get_product_set(products: "Products") -> ProductSet:
+    if (item := _product_sets.get(id(products))) is None:
+        item = _product_sets[id(products)] = ProductSet(products)
+    return item
+
+
+def get_options(products: "Products") -> dict[str, list]:
+    return {
+        attr: list(
+            {
+                option.name: None
+                for product in products
+                if (setting := product.settings.get(attr))
+                for option in setting.items or ()
+            }.keys()  # unique keys with save order
+        )
+        for attr in SELECTS
+    }
@@ -0,0 +1,23 @@
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from . import DOMAIN
+from .core.arbiter import arbiter
+from .core.device import Device
+
+# machine and proxy MACs, machine identity from advertisement
+TO_REDACT = {"mac", "source", "serial_number", "machine_number"}
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict:
+    # device is missing while model is resolving from first advertisement
+    device: Device | None = hass.data[DOMAIN].get(entry.entry_id)
+    data = {
+        "entry": entry.as_dict(),
+        "device": device.diagnostics() if device else None,
+        "arbiter": arbiter.metrics(),
+    }
+    return async_redact_data(data, TO_REDACT)
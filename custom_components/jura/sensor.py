@@ -0,0 +1,120 @@
+from homeassistant.components.sensor import (
+    RestoreSensor,
+    SensorDeviceClass,
+    SensorEntity,
+    SensorStateClass,
+)
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import PERCENTAGE, EntityCategory, UnitOfTime
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from . import DOMAIN
+from .core.device import ADVERTISEMENT, STATS_MAINTENANCE_PERCENTS, TIMINGS, Device
+from .core.entity import JuraEntity
+
+
+async def async_setup_entry(
+    hass: HomeAssistant, config_entry: ConfigEntry, add_entities: AddEntitiesCallback
+) -> None:
+    device = hass.data[DOMAIN][config_entry.entry_id]
+
+    add_entities(
+        [JuraInfo(device, attr) for attr in ADVERTISEMENT]
+        + [JuraCounter(device, attr) for attr in device.counters]
+        + [JuraMaintenance(device, attr) for attr in device.maintenance]
+        + [JuraMaintenanceDue(device, attr) for attr in device.maintenance_due]
+        + [JuraTiming(device, attr) for attr in TIMINGS]
+    )
+
+
+class JuraInfo(JuraEntity, SensorEntity):
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def __init__(self, device: Device, attr: str):
+        if attr == "production_date":
+            self._attr_device_class = SensorDeviceClass.DATE
+        elif attr in ("machine_number", "status_bits"):
+            self._attr_entity_registry_enabled_default = False
+        super().__init__(device, attr)
+
+    def internal_update(self):
+        attribute = self.device.attribute(self.attr)
+
+        self._attr_available = "value" in attribute
+        self._attr_native_value = attribute.get("value")
+        self._attr_extra_state_attributes = attribute.get("extra")
+
+        if self.hass:
+            self._async_write_ha_state()
+
+    async def async_update(self):
+        pass  # passive entity, don't connect to machine
+
+
+class JuraTiming(JuraInfo):
+    """Median of last timings in ms, full histogram in attributes."""
+
+    _attr_device_class = SensorDeviceClass.DURATION
+    _attr_entity_registry_enabled_default = False
+    _attr_native_unit_of_measurement = UnitOfTime.MILLISECONDS
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+
+class JuraStatistic(JuraEntity, RestoreSensor):
+    async def async_added_to_hass(self) -> None:
+        await super().async_added_to_hass()
+
+        # statistics are read only during sessions, show last value while idle
+        if not self._attr_available and (
+            data := await self.async_get_last_sensor_data()
+        ):
+            self._attr_available = data.native_value is not None
+            self._attr_native_value = data.native_value
+
+    def internal_update(self):
+        attribute = self.device.attribute(self.attr)
+
+        if "value" in attribute:
+            self._attr_available = True
+            self._attr_native_value = attribute["value"]
+            self._attr_extra_state_attributes = attribute.get("extra")
+        elif not self.hass:
+            self._attr_available = False
+
+        if self.hass:
+            self._async_write_ha_state()
+
+    async def async_update(self):
+        pass  # refreshed with statistics during sessions
+
+
+class JuraCounter(JuraStatistic):
+    _attr_state_class = SensorStateClass.TOTAL_INCREASING
+
+    def __init__(self, device: Device, attr: str):
+        # enable only total counter, product counters are optional
+        self._attr_entity_registry_enabled_default = device.counters[attr] == 0
+        super().__init__(device, attr)
+
+
+class JuraMaintenance(JuraStatistic):
+    # maintenance statistics modes are experimental, read only for enabled sensors
+    _attr_entity_registry_enabled_default = False
+
+    def __init__(self, device: Device, attr: str):
+        if attr in device.maintenance:
+            if device.maintenance[attr][0] == STATS_MAINTENANCE_PERCENTS:
+                self._attr_native_unit_of_measurement = PERCENTAGE
+                self._attr_state_class = SensorStateClass.MEASUREMENT
+            else:
+                self._attr_state_class = SensorStateClass.TOTAL_INCREASING
+        super().__init__(device, attr)
+
+    async def async_added_to_hass(self) -> None:
+        await super().async_added_to_hass()
+        self.device.request_maintenance(self.attr)
+
+
+class JuraMaintenanceDue(JuraMaintenance):
+    _attr_device_class = SensorDeviceClass.TIMESTAMP
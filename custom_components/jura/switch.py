@@ -1,8 +1,7 @@
-import asyncio
-
 from homeassistant.components.switch import SwitchEntity
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
+from homeassistant.exceptions import HomeAssistantError
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 
 from . import DOMAIN
@@ -26,12 +25,10 @@ class JuraSwitch(JuraEntity, SwitchEntity):
 
     async def async_turn_on(self) -> None:
         self.device.client.ping()
-        for _ in range(5):
-            if not self.device.connected:
-                await asyncio.sleep(1)
+        if not await self.device.wait_connected(True):
+            raise HomeAssistantError("Can't connect to coffee machine")
 
     async def async_turn_off(self) -> None:
         self.device.client.ping_cancel()
-        for _ in range(5):
-            if self.device.connected:
-                await asyncio.sleep(1)
+        if not await self.device.wait_connected(False):
+            raise HomeAssistantError("Can't disconnect from coffee machine")
@@ -0,0 +1,364 @@
+"""Performance benchmarks. Run with: python -m tests.benchmark [--save]
+
+Results are compared with baseline in tests/benchmark.json, --save updates it.
+"""
+
+import asyncio
+import gc
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+from pathlib import Path
+from zipfile import ZipFile
+
+from bleak import BLEDevice
+
+from custom_components.jura.core import catalog, encryption
+from custom_components.jura.core.device import SELECTS, Device, get_machine_by_id
+from custom_components.jura.core.parser import parse_model
+from custom_components.jura.core.product import get_options
+
+try:
+    import xmltodict
+except ImportError:
+    xmltodict = None
+
+BASELINE = Path(__file__).with_suffix(".json")
+
+# encrypted frames from test_encdec and test_status_* with their keys
+VECTORS = [
+    ("77c23dd05e81d3dba32bf898a4a3faab45fd", 0x2A),
+    ("77ea3dd38981dadba32bfa98a4a3faab45fd", 0x2A),
+    ("77E13ED68882D3D7A323FA98A4A3FAAB4756A629", 0x2A),
+    ("77D23DD68882D3D7A323FA98A4A3FAAB4756A625", 0x2A),
+    ("77113DD68882D3D7A323FA98A4A3FAAB4756A625", 0x2A),
+    ("77913DD6888BD3D7A323FA98A4A3FAAB4756A625", 0x2A),
+    ("14444CC623152D9ABFE772ED1B3F65136B888DDC", 0),
+    ("14A44CC623153D94BFE772ED1B3F65136B888DD2", 0),
+    ("14044CC623153D94BFE772ED1B3F65136B888DDC", 0),
+    ("144448C623753D94BFE772ED1B3F65136B888DDC", 0),
+    ("144448C623752D94BFE772ED1B3F65136B888DD2", 0),
+]
+
+
+def encdec_reference(src: bytes, key: int) -> bytes:
+    """Original per-nibble implementation."""
+    dst = b""
+    key1 = key >> 4
+    key2 = key & 0xF
+    cnt = 0
+    for b in src:
+        dst1 = encryption.shuffle(b >> 4, cnt, key1, key2)
+        cnt += 1
+        dst2 = encryption.shuffle(b & 0xF, cnt, key1, key2)
+        cnt += 1
+        dst += bytes([(dst1 << 4) | dst2])
+    return dst
+
+
+def timeit(func, *args, number: int = 1000) -> float:
+    """Return average call time in microseconds."""
+    ts = time.perf_counter()
+    for _ in range(number):
+        func(*args)
+    return (time.perf_counter() - ts) / number * 1e6
+
+
+def timeit_total(func, *args, number: int = 1000) -> float:
+    """Return total time in seconds."""
+    ts = time.perf_counter()
+    for _ in range(number):
+        func(*args)
+    return time.perf_counter() - ts
+
+
+def bench_encdec() -> dict:
+    vectors = [(bytes.fromhex(data), key) for data, key in VECTORS]
+
+    # check byte to byte compatibility before timings
+    for data, key in vectors:
+        assert encryption.encdec(data, key) == encdec_reference(data, key)
+
+    data, key = vectors[2]
+    frames = [data] * 1000
+    assert encryption.encdec_batch(frames, key) == [encdec_reference(data, key)] * 1000
+
+    def encdec_cold(data: bytes, key: int):
+        encryption.get_table.cache_clear()
+        encryption.encdec(data, key)
+
+    return {
+        "encdec_reference_us": timeit(encdec_reference, data, key),
+        # first frame with new session key, includes table build
+        "encdec_cold_us": timeit(encdec_cold, data, key, number=100),
+        "encdec_us": timeit(encryption.encdec, data, key),
+        "encdec_batch_1000_us": timeit(encryption.encdec_batch, frames, key, number=10),
+        "encdec_mb_s": len(data)
+        * 1000
+        * 10
+        / timeit_total(encryption.encdec_batch, frames, key, number=10)
+        / 1e6,
+        "numpy": encryption.get_numpy() is not None,
+    }
+
+
+def measure(func, items: list) -> tuple[float, int]:
+    """Return total time in milliseconds and peak memory in KB."""
+    ts = time.perf_counter()
+    for item in items:
+        func(item)
+    ms = (time.perf_counter() - ts) * 1e3
+
+    # separate run, tracemalloc slows down allocations
+    tracemalloc.start()
+    for item in items:
+        func(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return ms, peak // 1024
+
+
+def bench_parser() -> dict:
+    """Compare full xmltodict parse with streaming extractor for all model XMLs."""
+    with ZipFile(catalog.RESOURCES) as f:
+        xmls = [
+            f.read(i)
+            for i in f.namelist()
+            if i.startswith("documents/xml/") and i.endswith(".xml")
+        ]
+
+    def stream(data: bytes):
+        return parse_model(BytesIO(data))
+
+    result = {"xml_files": len(xmls), "xml_kb": sum(map(len, xmls)) // 1024}
+    result["stream_ms"], result["stream_peak_kb"] = measure(stream, xmls)
+    if xmltodict:
+        result["xmltodict_ms"], result["xmltodict_peak_kb"] = measure(
+            xmltodict.parse, xmls
+        )
+    return result
+
+
+def get_models() -> dict[str, int]:
+    """First model_id for each model XML used by machines list."""
+    models = {}
+    for model_id, (_, filename) in catalog.load_catalog()["machines"].items():
+        models.setdefault(filename, model_id)
+    return models
+
+
+def bench_model(model_id: int) -> dict:
+    """Timings for one model, per call in microseconds."""
+    ts = time.perf_counter()
+    machine = get_machine_by_id(model_id)
+    get_machine_us = (time.perf_counter() - ts) * 1e6
+
+    ts = time.perf_counter()
+    get_options(machine["products"])
+    get_options_us = (time.perf_counter() - ts) * 1e6
+
+    device = Device(
+        "", machine["model"], machine["products"], BLEDevice("", None, None, 0)
+    )
+    device.client.ping = lambda: None
+    attrs = SELECTS + device.numbers()
+
+    attribute_time = command_time = 0
+    for name in device.products_by_name:
+        device.select_product(name)
+
+        ts = time.perf_counter()
+        for attr in attrs:
+            device.attribute(attr)
+        attribute_time += time.perf_counter() - ts
+
+        ts = time.perf_counter()
+        device.command()
+        command_time += time.perf_counter() - ts
+
+    products = len(device.products_by_name)
+    return {
+        "products": products,
+        "attributes": products * len(attrs),
+        "get_machine_us": get_machine_us,
+        "get_options_us": get_options_us,
+        "attribute_us": attribute_time / products / len(attrs) * 1e6,
+        "command_us": command_time / products * 1e6,
+    }
+
+
+async def bench_models() -> tuple[dict, dict]:
+    """Timings for all models and for each model XML. Async because Device
+    needs running loop.
+    """
+    ts = time.perf_counter()
+    catalog.compile_catalog(catalog.RESOURCES)
+    compile_ms = (time.perf_counter() - ts) * 1e3
+
+    models = get_models()
+    bench_model(next(iter(models.values())))  # warm up first call caches
+    gc.collect()  # drop warm up device, so products are loaded again
+
+    # documents/xml/EF538/1.0.xml => EF538/1.0
+    per_model = {
+        filename[14:-4]: bench_model(model_id) for filename, model_id in models.items()
+    }
+
+    items = per_model.values()
+    products = sum(i["products"] for i in items)
+    attributes = sum(i["attributes"] for i in items)
+    return {
+        "models": len(per_model),
+        "products": products,
+        "catalog_compile_ms": compile_ms,
+        "get_machine_us": sum(i["get_machine_us"] for i in items) / len(items),
+        "get_options_us": sum(i["get_options_us"] for i in items) / len(items),
+        "attribute_us": sum(i["attribute_us"] * i["attributes"] for i in items)
+        / attributes,
+        "command_us": sum(i["command_us"] * i["products"] for i in items) / products,
+    }, per_model
+
+
+async def bench_memory(count: int = 50) -> dict:
+    """Memory for a host with many machines, in KB."""
+    ble = BLEDevice("", None, None, 0)
+    model_ids = list(get_models().values())
+
+    def create(ids: list[int]) -> list[Device]:
+        devices = []
+        for model_id in ids:
+            machine = get_machine_by_id(model_id)
+            devices.append(
+                Device(
+                    "",
+                    machine["model"],
+                    machine["products"],
+                    ble,
+                    machine["alerts"],
+                    machine["counters"],
+                    machine["maintenance"],
+                )
+            )
+        return devices
+
+    catalog.load_catalog()
+
+    tracemalloc.start()
+    first = tracemalloc.get_traced_memory()[0]
+    devices = create(model_ids[:1])
+    single = tracemalloc.get_traced_memory()[0]
+    devices += create(model_ids[:1] * (count - 1))
+    same = tracemalloc.get_traced_memory()[0]
+    del devices
+    gc.collect()  # devices and clients reference each other
+    devices = create((model_ids * count)[:count])
+    mixed = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return {
+        "devices": count,
+        "first_device_kb": (single - first) // 1024,
+        "same_model_per_device_kb": round((same - single) / (count - 1) / 1024, 1),
+        "same_model_total_kb": (same - first) // 1024,
+        "mixed_models_total_kb": (mixed - first) // 1024,
+    }
+
+
+# fresh interpreter for each measurement, Home Assistant and BLE libs are
+# preloaded like in test_import_time, so only integration's own cost is measured
+IMPORT_SCRIPT = """
+import json, sys, time, tracemalloc
+import bleak, voluptuous
+from homeassistant.components import bluetooth
+from homeassistant.helpers import config_validation, device_registry
+if sys.argv[2] == "memory":
+    tracemalloc.start()
+ts = time.perf_counter()
+__import__(sys.argv[1])
+if sys.argv[3] == "devices":
+    from tests.benchmark import get_models
+    from custom_components.jura.core import catalog
+    for model_id in get_models().values():
+        catalog.get_model(model_id)
+ms = (time.perf_counter() - ts) * 1e3
+peak = tracemalloc.get_traced_memory()[1] // 1024 if tracemalloc.is_tracing() else 0
+print(json.dumps([ms, peak]))
+"""
+
+
+def run_script(module: str, mode: str, load: str = "") -> list:
+    args = [sys.executable, "-c", IMPORT_SCRIPT, module, mode, load or "-"]
+    cwd = Path(__file__).parent.parent
+    return json.loads(subprocess.check_output(args, cwd=cwd))
+
+
+def bench_import() -> dict:
+    core = "custom_components.jura.core.device"
+    return {
+        "import_core_ms": min(run_script(core, "time")[0] for _ in range(3)),
+        "import_core_peak_kb": run_script(core, "memory")[1],
+        "import_ms": min(
+            run_script("custom_components.jura", "time")[0] for _ in range(3)
+        ),
+        "import_peak_kb": run_script("custom_components.jura", "memory")[1],
+        "catalog_peak_kb": run_script(core, "memory", "devices")[1],
+    }
+
+
+def run() -> dict:
+    models, per_model = asyncio.run(bench_models())
+    return {
+        "encdec": bench_encdec(),
+        "parser": bench_parser(),
+        "models": models,
+        "per_model": per_model,
+        "memory": asyncio.run(bench_memory()),
+        "import": bench_import(),
+    }
+
+
+def compare(items: dict, baseline: dict) -> list[str]:
+    lines = []
+    for k, v in items.items():
+        line = f"{k}: {v:.2f}" if isinstance(v, float) else f"{k}: {v}"
+        base = baseline.get(k)
+        if isinstance(v, float) and base:
+            line += f" (baseline {base:.2f}, {(v - base) / base:+.0%})"
+        lines.append(line)
+    return lines
+
+
+def rounded(value):
+    if isinstance(value, dict):
+        return {k: rounded(v) for k, v in value.items()}
+    return round(value, 2) if isinstance(value, float) else value
+
+
+def main():
+    result = run()
+
+    try:
+        baseline = json.loads(BASELINE.read_text())
+    except FileNotFoundError:
+        baseline = {}
+
+    for group, items in result.items():
+        print(f"[{group}]")
+        base = baseline.get(group, {})
+        if group == "per_model":
+            # one line per model XML
+            for k, v in items.items():
+                print(f"{k}: " + ", ".join(compare(v, base.get(k, {}))))
+        else:
+            print("\n".join(compare(items, base)))
+
+    if "--save" in sys.argv:
+        BASELINE.write_text(json.dumps(rounded(result), indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""In-process BLE coffee machine simulator for Client tests and load tests.
+
+Run load test with: python -m tests.simulator
+"""
+
+import asyncio
+import random
+import time
+from contextlib import contextmanager
+from unittest import mock
+
+from bleak import BLEDevice, BleakError
+
+from custom_components.jura.core import client
+from custom_components.jura.core.arbiter import Arbiter
+from custom_components.jura.core.encryption import encdec
+
+SOURCE = "simulator"
+
+
+class SimMachine:
+    def __init__(
+        self,
+        address: str,
+        key: int = 0x2A,
+        latency: float = 0.005,
+        drop_rate: float = 0.0,
+        disconnect_rate: float = 0.0,
+        seed: int = None,
+    ):
+        self.address = address
+        self.key = key
+        self.latency = latency
+        self.drop_rate = drop_rate  # failed GATT operation
+        self.disconnect_rate = disconnect_rate  # link lost on GATT operation
+        self.random = random.Random(seed)
+
+        self.status = bytearray(19)
+        self.counters = bytearray(b"\xff" * 3 * 64)
+        self.counters[0:3] = bytes(3)
+        self.stats_mode = None
+
+        self.connected: "SimClient | None" = None
+        self.connects = 0
+        self.attempts: list[float] = []  # loop time of each connect attempt
+        self.drops = 0
+        self.disconnects = 0
+        self.commands: list[bytes] = []  # decrypted product commands
+
+    @property
+    def device(self) -> BLEDevice:
+        return BLEDevice(self.address, "TT214H BlueFrog", {"source": SOURCE}, -60)
+
+    def set_alert(self, bit: int, value: bool):
+        if value:
+            self.status[bit // 8] |= 0x80 >> bit % 8
+        else:
+            self.status[bit // 8] &= ~(0x80 >> bit % 8)
+        if self.connected and self.connected.notify:
+            self.connected.notify(None, self.status_frame())
+
+    def status_frame(self) -> bytearray:
+        return bytearray(encdec(bytes([self.key]) + self.status, self.key))
+
+    def make_product(self, data: bytes):
+        self.commands.append(data)
+        pos = data[1] * 3
+        if self.counters[pos : pos + 3] == b"\xff\xff\xff":
+            self.counters[pos : pos + 3] = bytes(3)
+        for pos in {0, pos}:
+            value = int.from_bytes(self.counters[pos : pos + 3], "big") + 1
+            self.counters[pos : pos + 3] = value.to_bytes(3, "big")
+
+
+class SimClient:
+    """Stand-in for BleakClient connected to SimMachine."""
+
+    def __init__(self, machine: SimMachine):
+        self.machine = machine
+        self.notify = None
+        self.is_connected = True
+
+    async def _io(self):
+        machine = self.machine
+        await asyncio.sleep(machine.latency)
+        if not self.is_connected:
+            raise BleakError("Not connected")
+        if machine.random.random() < machine.disconnect_rate:
+            machine.disconnects += 1
+            self._lost()
+            raise BleakError("Disconnected")
+        if machine.random.random() < machine.drop_rate:
+            machine.drops += 1
+            raise BleakError("Operation failed")
+
+    def _lost(self):
+        self.is_connected = False
+        if self.machine.connected is self:
+            self.machine.connected = None
+
+    async def read_gatt_char(self, uuid: str) -> bytearray:
+        await self._io()
+        machine = self.machine
+        if uuid == client.UUID_KEY:
+            return bytearray([machine.key])
+        if uuid == client.UUID_STATUS:
+            return machine.status_frame()
+        if uuid == client.UUID_STATS_DATA and machine.stats_mode == 1:
+            return bytearray(encdec(bytes(machine.counters), machine.key))
+        raise BleakError(f"Unsupported read: {uuid}")
+
+    async def write_gatt_char(self, uuid: str, data: bytes, response: bool = True):
+        await self._io()
+        machine = self.machine
+        data = encdec(data, machine.key)
+        if data[0] != machine.key:
+            raise BleakError("Wrong key")
+        if uuid == client.UUID_PRODUCT:
+            machine.make_product(data)
+        elif uuid == client.UUID_STATS_COMMAND:
+            machine.stats_mode = data[2]
+        else:
+            raise BleakError(f"Unsupported write: {uuid}")
+
+    async def start_notify(self, uuid: str, callback):
+        await self._io()
+        if uuid != client.UUID_STATUS:
+            raise BleakError(f"Unsupported notify: {uuid}")
+        self.notify = callback
+
+    async def disconnect(self):
+        await asyncio.sleep(self.machine.latency)
+        self._lost()
+
+
+class Simulator:
+    def __init__(self, machines: list[SimMachine]):
+        self.machines = {i.address: i for i in machines}
+
+    async def establish_connection(self, client_class, device: BLEDevice, name, **kw):
+        machine = self.machines[device.address]
+        machine.attempts.append(asyncio.get_running_loop().time())
+        await asyncio.sleep(machine.latency * 5)
+        if machine.random.random() < machine.drop_rate:
+            machine.drops += 1
+            raise BleakError("Connection failed")
+        if machine.connected:
+            raise BleakError("Already connected")
+        machine.connects += 1
+        machine.connected = SimClient(machine)
+        return machine.connected
+
+    @contextmanager
+    def patch(self, slots: int = 3, **constants):
+        """Replace establish_connection and arbiter, override client constants,
+        like KEEPALIVE_TIME or BACKOFF.
+        """
+        arbiter = Arbiter()
+        arbiter.set_slots(SOURCE, slots)
+        with mock.patch.multiple(
+            client,
+            establish_connection=self.establish_connection,
+            arbiter=arbiter,
+            **constants,
+        ):
+            yield arbiter
+
+
+FAST = {
+    "KEEPALIVE_MIN": 0.05,
+    "KEEPALIVE_MAX": 0.2,
+    "KEEPALIVE_TIME": 0.1,
+    "BACKOFF": {
+        None: (0.01, 0.01),
+        "timeout": (0.01, 0.1),
+        "bleak": (0.01, 0.1),
+        "other": (0.01, 0.1),
+    },
+    "STATS_WAIT": 0.01,
+}
+
+
+async def load_test(
+    count: int = 30,
+    commands: int = 3,
+    slots: int = 3,
+    latency: float = 0.005,
+    drop_rate: float = 0.02,
+    disconnect_rate: float = 0.01,
+    timeout: float = 10,
+) -> dict:
+    """Send commands to many simulated machines on one event loop."""
+    machines = [
+        SimMachine(
+            f"00:00:00:00:{i // 256:02X}:{i % 256:02X}",
+            latency=latency,
+            drop_rate=drop_rate,
+            disconnect_rate=disconnect_rate,
+            seed=i,
+        )
+        for i in range(count)
+    ]
+    sim = Simulator(machines)
+
+    with sim.patch(slots, **FAST) as arbiter:
+        clients = [client.Client(i.device) for i in machines]
+
+        ts = time.perf_counter()
+        futures = [
+            i.send(bytes([0, n + 2]) + bytes(16), timeout)
+            for n in range(commands)
+            for i in clients
+        ]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        elapsed = time.perf_counter() - ts
+
+        for i in clients:
+            i.ping_cancel()
+        await asyncio.gather(*[i.ping_task for i in clients if i.ping_task])
+
+    latency = sorted(v for i in clients for v in i.timings["send"].samples)
+    return {
+        "machines": count,
+        "commands": len(futures),
+        "failed": sum(1 for i in results if i is not True),
+        "delivered": sum(len(i.commands) for i in machines),
+        "elapsed_s": round(elapsed, 2),
+        "latency_p50_ms": round(latency[len(latency) // 2] * 1e3, 1),
+        "latency_p95_ms": round(latency[int(len(latency) * 0.95)] * 1e3, 1),
+        "connects": sum(i.connects for i in machines),
+        "drops": sum(i.drops for i in machines),
+        "disconnects": sum(i.disconnects for i in machines),
+        "errors": sum(sum(i.errors.values()) for i in clients),
+        **arbiter.metrics(),
+    }
+
+
+def main():
+    for k, v in asyncio.run(load_test()).items():
+        print(f"{k}: {v}")
+
+
+if __name__ == "__main__":
+    main()
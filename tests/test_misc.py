@@ -1,20 +1,73 @@
 import asyncio
-
-from bleak import BLEDevice
-
-from custom_components.jura import get_machine
-from custom_components.jura.core.device import Device
-from custom_components.jura.core.encryption import encdec
+import gc
+import json
+import subprocess
+import sys
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from pathlib import Path
+from unittest import mock
+
+import pytest
+from bleak import AdvertisementData, BLEDevice
+
+from custom_components.jura.binary_sensor import JuraAlert
+from custom_components.jura.core import DOMAIN, catalog
+from custom_components.jura.core.arbiter import Arbiter
+from custom_components.jura.core.client import encrypt
+from custom_components.jura.core.device import (
+    MAINTENANCE_TTL,
+    STATS_INTERVAL,
+    STATS_MAINTENANCE_COUNTERS,
+    STATS_MAINTENANCE_PERCENTS,
+    STATS_PRODUCTS,
+    Device,
+    UnsupportedModel,
+    async_get_machine,
+    get_machine,
+)
+from custom_components.jura.core.encryption import encdec, encdec_batch
+from custom_components.jura.core.metrics import Histogram
+from custom_components.jura.core.parser import Option
+from custom_components.jura.diagnostics import async_get_config_entry_diagnostics
 from custom_components.jura.select import JuraSelect
+from custom_components.jura.sensor import JuraMaintenanceDue
+from tests.benchmark import VECTORS, encdec_reference
+
+# own import cost of integration, Home Assistant and bleak are already loaded
+IMPORT_BUDGET_MS = 100
+IMPORT_SCRIPT = """
+import json, sys, time
+import bleak, voluptuous
+from homeassistant.components import bluetooth
+from homeassistant.helpers import config_validation, device_registry
+ts = time.perf_counter()
+import custom_components.jura
+ms = (time.perf_counter() - ts) * 1e3
+print(json.dumps([ms, list(sys.modules)]))
+"""
 
 
 def make_device(adv: bytes) -> Device:
+    get_running_loop = asyncio.get_running_loop
     asyncio.get_running_loop = lambda: None
 
     machine = get_machine(adv)
     ble = BLEDevice("", None, None, 0)
-    device = Device("Jura", machine["model"], machine["products"], ble)
+    device = Device(
+        "Jura",
+        machine["model"],
+        machine["products"],
+        ble,
+        machine["alerts"],
+        machine["counters"],
+        machine["maintenance"],
+    )
     device.client.ping = lambda *args: None
+
+    asyncio.get_running_loop = get_running_loop
     return device
 
 
@@ -225,6 +278,358 @@ def test_device_x8c():
     assert device.model == "GIGA X8c Professional"
 
 
+def test_advertisement():
+    adv = bytes.fromhex("2a0508039c35921532006d33793201000000000000000000000000")
+    device = make_device(adv)
+    assert device.attribute("firmware") == {}
+
+    updates = []
+    device.register_update("serial_number", lambda: updates.append(1))
+    device.update_ble(AdvertisementData(None, {171: adv}, {}, [], None, -60, ()))
+    device.update_ble(AdvertisementData(None, {171: adv}, {}, [], None, -60, ()))
+    assert updates == [1]
+
+    assert device.client.key == 0x2A
+    assert device.attribute("firmware") == {"value": "5.8"}
+    assert device.attribute("serial_number") == {"value": 50}
+    assert device.attribute("machine_number") == {"value": 5522}
+    assert device.attribute("production_date") == {
+        "value": date(2015, 11, 13),
+        "extra": {"uchi_date": date(2015, 3, 25)},
+    }
+
+
+def test_statistics():
+    device = make_device(b"*\x05\x08\x03\xfb;")
+    assert device.counters["total_products"] == 0
+    assert device.counters["counter_espresso"] == 2
+    assert device.attribute("total_products") == {}
+    # read product counters in first session, maintenance only on request
+    assert device.client.stats_due == {STATS_PRODUCTS: 0}
+
+    async def main():
+        device.client.loop = asyncio.get_running_loop()
+        device.client.stats_due.clear()
+
+        updates = []
+        device.register_update("total_products", lambda: updates.append(1))
+
+        data = bytearray(b"\xff" * 3 * 64)
+        data[0:3] = (1234).to_bytes(3, "big")
+        data[6:9] = (100).to_bytes(3, "big")
+        device.update_stats(STATS_PRODUCTS, data)
+        device.update_stats(STATS_PRODUCTS, data)
+        assert updates == [1]
+
+        assert device.attribute("total_products") == {"value": 1234}
+        assert device.attribute("counter_espresso") == {"value": 100}
+        assert device.attribute("counter_coffee") == {}
+
+        # long interval refresh, product start makes it earlier
+        due = device.client.stats_due[STATS_PRODUCTS]
+        assert due >= device.client.loop.time() + STATS_INTERVAL - 1
+        device.client.send = lambda data: asyncio.sleep(0)
+        await device.make_product("Espresso", {})
+        assert device.client.stats_due[STATS_PRODUCTS] < due
+
+    asyncio.run(main())
+
+
+def test_maintenance():
+    device = make_device(b"*\x05\x08\x03\xfb;")
+    assert device.maintenance["filter_change_percent"] == (
+        STATS_MAINTENANCE_PERCENTS,
+        "FilterChange",
+    )
+    assert device.maintenance_due == {"filter_change_due": "FilterChange"}
+
+    # unconfirmed modes are read only for enabled sensors
+    sensor = JuraMaintenanceDue(device, "filter_change_due")
+    assert sensor.entity_registry_enabled_default is False
+    assert STATS_MAINTENANCE_COUNTERS not in device.client.stats_due
+    device.request_maintenance("filter_change_due")
+    device.request_maintenance("cleaning_percent")
+    assert device.client.stats_due == {
+        STATS_PRODUCTS: 0,
+        STATS_MAINTENANCE_COUNTERS: 0,
+        STATS_MAINTENANCE_PERCENTS: 0,
+    }
+
+    async def main():
+        device.client.loop = asyncio.get_running_loop()
+        device.client.stats_due.clear()
+
+        # Cleaning, FilterChange, Decalc, CappuRinse, CoffeeRinse, CappuClean
+        data = bytes.fromhex("000a0003ffff000100020003")
+        device.update_stats(STATS_MAINTENANCE_COUNTERS, data)
+        assert device.attribute("cleaning_count") == {"value": 10}
+        assert device.attribute("decalc_count") == {}
+        assert device.attribute("filter_change_due") == {}
+
+        data = bytes.fromhex("000a0004ffff000100020003")
+        device.update_stats(STATS_MAINTENANCE_COUNTERS, data)
+        due = device.attribute("filter_change_due")["value"]
+        assert 89 <= (due - datetime.now(timezone.utc)).days <= 90
+
+        device.update_stats(STATS_MAINTENANCE_PERCENTS, bytes([85, 20, 0xFF]))
+        assert device.attribute("cleaning_percent") == {
+            "value": 85,
+            "extra": {"threshold": 80, "required": True},
+        }
+        assert device.attribute("decalc_percent") == {}
+
+        due = device.client.stats_due[STATS_MAINTENANCE_PERCENTS]
+        assert due >= device.client.loop.time() + MAINTENANCE_TTL - 1
+
+    asyncio.run(main())
+
+
+def test_import_time():
+    cwd = Path(__file__).parent.parent
+    ms, modules = min(
+        json.loads(
+            subprocess.check_output([sys.executable, "-c", IMPORT_SCRIPT], cwd=cwd)
+        )
+        for _ in range(3)
+    )
+    assert ms < IMPORT_BUDGET_MS
+
+    # loaded on first use
+    for name in ("numpy", "custom_components.jura.core.client", "xml.parsers.expat"):
+        assert name not in modules
+
+
+def test_catalog():
+    machines = catalog.load_catalog()["machines"]
+    assert machines[15355] == ("E8 (EB)", "documents/xml/EF538/1.0.xml")
+
+    model = catalog.get_model(15355)
+    product = next(i for i in model["products"] if i.name == "Espresso")
+    assert product.code == 2 and product.active
+    assert product.settings["coffee_strength"].items[0] == Option("1", 1)
+    assert model["counters"][0] == (0, "Total Products")
+
+    with pytest.raises(UnsupportedModel):
+        get_machine(b"*\x05\x08\x03\x01\x00")
+
+
+def test_catalog_cache(tmp_path, monkeypatch, caplog):
+    # cache is invalid after parser code update without manual version bump
+    source = tmp_path / "parser.py"
+    source.write_text("v1")
+    monkeypatch.setattr(catalog, "SOURCES", [source])
+    value = catalog.fingerprint(catalog.RESOURCES)
+    source.write_text("v2")
+    assert catalog.fingerprint(catalog.RESOURCES) != value
+
+    # read-only install
+    monkeypatch.setattr(catalog, "CACHE", tmp_path / "readonly" / "cache.pickle")
+    monkeypatch.setattr(catalog, "_catalog", None)
+    monkeypatch.setattr(catalog, "compile_catalog", lambda path: {"machines": {}})
+    assert catalog.load_catalog() == {"machines": {}}
+    assert "Can't save catalog cache" in caplog.text
+    assert caplog.records[-1].levelname == "WARNING"
+
+
+def test_catalog_concurrent(tmp_path, monkeypatch):
+    calls = []
+
+    def compile_catalog(path):
+        calls.append(path)
+        time.sleep(0.05)
+        return {"machines": {}}
+
+    monkeypatch.setattr(catalog, "CACHE", tmp_path / "cache.pickle")
+    monkeypatch.setattr(catalog, "_catalog", None)
+    monkeypatch.setattr(catalog, "compile_catalog", compile_catalog)
+
+    # executor threads for different models
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda _: catalog.load_catalog(), range(4)))
+    assert len(calls) == 1
+    assert all(i is results[0] for i in results)
+
+    # cache is written via temp file
+    assert [i.name for i in tmp_path.iterdir()] == ["cache.pickle"]
+
+
+def test_async_get_machine():
+    async def main():
+        future = async_get_machine(15355)
+        assert async_get_machine(15355) is future
+        assert (await future)["model"] == "E8 (EB)"
+
+        future = async_get_machine(1)
+        with pytest.raises(UnsupportedModel):
+            await future
+        # negative cache
+        assert async_get_machine(1) is future
+
+    asyncio.run(main())
+
+
+def test_command_template():
+    device1 = make_device(b"*\x05\x08\x03\xfb;")
+    device2 = make_device(b"*\x05\x08\x03\xfb;")
+    assert device1.templates is device2.templates
+
+    device1.select_option("product", "Cafe Barista")
+    with pytest.raises(ValueError):
+        device1.set_value("water_amount", 500)
+    assert device1.command().hex() == "002800061200000100000900000000000000"
+
+
+def test_product_set():
+    device1 = make_device(b"*\x05\x08\x03\xfb;")
+    device2 = make_device(b"*\x05\x08\x03\xfb;")
+    assert device1.products is device2.products
+    assert device1.product_set is device2.product_set
+
+    # registry doesn't keep model data after last device is gone
+    ref = weakref.ref(device1.product_set)
+    del device1, device2
+    gc.collect()
+    assert ref() is None
+
+    # same for machine resolved in executor
+    async def main():
+        machine = await async_get_machine(15355)
+        ble = BLEDevice("", None, None, 0)
+        device = Device("Jura", machine["model"], machine["products"], ble)
+        refs = [weakref.ref(device.product_set), weakref.ref(machine["products"])]
+        del machine, device
+        await asyncio.sleep(0)  # loop handle that resumed this task holds future
+        gc.collect()
+        assert [i() for i in refs] == [None, None]
+
+    asyncio.run(main())
+
+
+def test_product_command():
+    device = make_device(b"*\x05\x08\x03\xfb;")
+
+    options = {"coffee_strength": "10", "water_amount": 50}
+    cmd = device.product_command("Cafe Barista", options)
+    assert cmd.hex() == "0028000a0a00000100000900000000000000"
+    assert device.product is None
+
+    with pytest.raises(ValueError):
+        device.product_command("Unknown", {})
+    with pytest.raises(ValueError):
+        device.product_command("Powderproduct", {})  # inactive
+    with pytest.raises(ValueError):
+        device.product_command("Cafe Barista", {"coffee_strength": "11"})
+    with pytest.raises(ValueError):
+        device.product_command("Cafe Barista", {"water_amount": 52})
+    with pytest.raises(ValueError):
+        device.product_command("Cafe Barista", {"milk_amount": 10})
+
+    # service path
+    with pytest.raises(ValueError):
+        asyncio.run(device.make_product("Cafe Barista", {"water_amount": 52}))
+    assert not device.client.commands
+
+
+def test_dispatch():
+    device = make_device(b"*\x05\x08\x03\xfb;")
+
+    updates = []
+    device.register_update("water_amount", lambda: updates.append("water"))
+    device.register_update("conn_info", lambda: updates.append("info"))
+
+    device.select_option("product", "Cafe Barista")
+    device.select_option("product", "Cafe Barista")
+    assert updates == ["water"]
+
+    # user's value should be reset on next product change
+    device.set_value("water_amount", 50)
+    device.select_option("product", "Cafe Barista")
+    assert updates == ["water", "water"]
+
+    adv = AdvertisementData(None, {}, {}, [], None, -60, ())
+    device.update_ble(adv)
+    device.update_ble(adv)
+    assert updates == ["water", "water", "info"]
+
+    # throttle interval is changed from options
+    device.rssi_interval = 0
+    device.update_ble(adv)
+    assert updates == ["water", "water", "info", "info"]
+
+
+def test_wait_connected():
+    device = make_device(b"*\x05\x08\x03\xfb;")
+
+    async def main():
+        assert await device.wait_connected(False, 0.01)
+        assert not await device.wait_connected(True, 0.01)
+
+        asyncio.get_running_loop().call_later(0.01, device.set_connected, True)
+        assert await device.wait_connected(True, 1)
+        assert not await device.wait_connected(False, 0.01)
+
+    asyncio.run(main())
+
+
+def test_best_ble_device():
+    device = make_device(b"*\x05\x08\x03\xfb;")
+    assert device.best_ble_device() is None
+
+    near = BLEDevice("", None, {"source": "proxy1"}, 0)
+    far = BLEDevice("", None, {"source": "proxy2"}, 0)
+    for rssi in (-60, -70, -65):
+        device.update_ble(AdvertisementData(None, {}, {}, [], None, rssi, ()), near)
+        device.update_ble(AdvertisementData(None, {}, {}, [], None, -80, ()), far)
+
+    assert device.best_ble_device() is near
+    assert device.conn_info["source"] == "proxy1"
+    assert device.client.source == "proxy1"
+
+    # local adapter, source only in service info
+    local = BLEDevice("", None, {}, 0)
+    for _ in range(3):
+        adv = AdvertisementData(None, {}, {}, [], None, -40, ())
+        device.update_ble(adv, local, "00:11:22:33:44:55")
+    assert device.best_ble_device() is local
+    assert device.client.source == "00:11:22:33:44:55"
+
+
+def test_status_alerts():
+    device = make_device(b"*\x05\x08\x03\xfb;")
+    assert device.attribute("empty_grounds") == {}
+
+    updates = []
+    device.register_update("empty_grounds", lambda: updates.append("grounds"))
+    device.register_update("fill_water", lambda: updates.append("water"))
+
+    b = bytes.fromhex("14444CC623152D9ABFE772ED1B3F65136B888DDC")
+    device.update_status(encdec(b, 0))
+    assert sorted(updates) == ["grounds", "water"]
+    assert device.attribute("empty_grounds") == {"is_on": False}
+
+    # coffee trash
+    b = bytes.fromhex("14A44CC623153D94BFE772ED1B3F65136B888DD2")
+    device.update_status(encdec(b, 0))
+    assert updates.count("grounds") == 2
+    assert len(updates) == 3
+    assert device.attribute("empty_grounds") == {"is_on": True}
+
+    # same frame - no updates
+    device.update_status(encdec(b, 0))
+    assert len(updates) == 3
+
+    # alerts are unknown after disconnect
+    device.set_connected(False)
+    assert device.attribute("empty_grounds") == {}
+    assert len(updates) == 5
+
+    # only typed alerts are problems, other bits are informational state
+    assert JuraAlert(device, "fill_water").device_class == "problem"
+    alert = JuraAlert(device, "coffee_ready")
+    assert alert.device_class is None
+    assert alert.entity_registry_enabled_default is False
+
+
 def test_coffee_strength():
     device = make_device(b"*\x05\x08\x03\xfb;")
 
@@ -300,3 +705,110 @@ def test_status_key00():
     b = bytes.fromhex("144448C623752D94BFE772ED1B3F65136B888DD2")
     b = encdec(b, 0)
     assert b.hex() == "0000040000200008000000000000000000000006"
+
+
+def test_encdec_table():
+    data = bytes(range(256)) * 2
+    for key in range(256):
+        assert encdec(data, key) == encdec_reference(data, key)
+
+    frames = [bytes.fromhex(i) for i, key in VECTORS if key == 0]
+    assert encdec_batch(frames, 0) == [encdec_reference(i, 0) for i in frames]
+
+
+def test_encrypt_cache():
+    data = bytes.fromhex("002800061200000100000900000000000000")
+    assert encrypt(data, 0x2A) is encrypt(data, 0x2A)
+    assert encdec(encrypt(data, 0x2A), 0x2A) == b"\x2a" + data[1:]
+
+
+def test_arbiter():
+    async def main():
+        arbiter = Arbiter()
+        arbiter.set_slots("proxy", 1)
+
+        class FakeClient:
+            loop = asyncio.get_running_loop()
+            device = BLEDevice("", None, {"source": "proxy"}, 0)
+            source = None
+            ping_time = float("inf")
+
+            def __init__(self):
+                self.commands = []
+                self.evicted = False
+
+            def evict(self):
+                self.evicted = True
+
+        idle, busy = FakeClient(), FakeClient()
+        assert await arbiter.acquire(idle)
+
+        # client with command evicts idle keepalive connection
+        busy.commands.append(b"")
+        task = asyncio.create_task(arbiter.acquire(busy))
+        await asyncio.sleep(0)
+        assert idle.evicted
+        assert arbiter.metrics()["queue"] == 1
+
+        arbiter.release(idle)
+        assert await task
+        assert arbiter.metrics()["queue"] == 0
+
+        # task is cancelled after slot was given
+        task = asyncio.create_task(arbiter.acquire(idle))
+        await asyncio.sleep(0)
+        arbiter.release(busy)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert arbiter.free_slots("proxy") == 1
+
+        # local adapters don't have source in BLEDevice details
+        idle.source = "00:11:22:33:44:55"
+        assert await arbiter.acquire(idle)
+        assert arbiter.metrics()["active"] == {"proxy": 0, "00:11:22:33:44:55": 1}
+
+    asyncio.run(main())
+
+
+def test_timings():
+    hist = Histogram(size=3)
+    assert hist.percentile(0.5) is None and hist.summary() == {"count": 0}
+    for value in (0.5, 0.002, 0.02, 0.04):
+        hist.add(value)
+    # percentiles only for last samples, buckets for all
+    assert hist.summary() == {
+        "count": 4,
+        "avg": 140.5,
+        "p50": 20.0,
+        "p95": 40.0,
+        "max": 40.0,
+        "buckets": {"le_0.01s": 1, "le_0.05s": 2, "le_0.5s": 1},
+    }
+
+    device = make_device(b"*\x05\x08\x03\xfb;")
+    assert device.attribute("connect_time") == {}
+    device.client.timings["connect"].add(0.25)
+    attr = device.attribute("connect_time")
+    assert attr["value"] == 250.0 and attr["extra"]["count"] == 1
+
+    data = bytes.fromhex("2a0508039c35921532006d33793201000000000000000000000000")
+    adv = AdvertisementData(None, {171: data}, {}, [], None, -60, ())
+    ble = BLEDevice("AA:BB:CC:DD:EE:FF", None, {}, 0)
+    device.update_ble(adv, ble, "00:11:22:33:44:55")
+    device.best_ble_device()
+    info = device.diagnostics()
+    assert info["model"] == device.model
+    assert info["timings"]["connect"]["count"] == 1
+    assert info["timings"]["update_ble"]["count"] == 1
+    assert info["client"]["connects"] == 0
+
+    # no MACs and machine identity in downloaded diagnostics
+    entry = mock.Mock(entry_id="1")
+    entry.as_dict.return_value = {"data": {"mac": "AA:BB:CC:DD:EE:FF"}}
+    hass = mock.Mock(data={DOMAIN: {"1": device}})
+    data = asyncio.run(async_get_config_entry_diagnostics(hass, entry))
+    assert data["device"]["advertisement"]["serial_number"] == "**REDACTED**"
+    text = str(data)
+    for value in ("AA:BB:CC:DD:EE:FF", "00:11:22:33:44:55", "5522"):
+        assert value not in text
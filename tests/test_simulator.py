@@ -0,0 +1,273 @@
+import asyncio
+
+from custom_components.jura.core.client import CIRCUIT_FAILURES, Client
+from tests.simulator import FAST, SOURCE, SimMachine, Simulator, load_test
+
+
+def test_client_session():
+    machine = SimMachine("00:00:00:00:00:01", seed=0)
+    sim = Simulator([machine])
+
+    statuses = []
+    stats = []
+
+    async def main():
+        with sim.patch(**FAST):
+            client = Client(
+                machine.device,
+                status_callback=lambda data: statuses.append(bytes(data)),
+                stats_callback=lambda mode, data: stats.append((mode, data)),
+            )
+
+            await client.send(bytes([0, 2]) + bytes(16))
+            assert machine.commands[0][1] == 2
+
+            machine.set_alert(1, True)
+            assert statuses[-1][0] == 0x2A and statuses[-1][1] == 0x40
+
+            client.request_stats(1)
+            await client.send(bytes([0, 3]) + bytes(16))
+            while not stats:
+                await asyncio.sleep(0.01)
+            assert stats[0][0] == 1
+            assert int.from_bytes(stats[0][1][0:3], "big") == 2  # total
+
+            client.ping_cancel()
+            await client.ping_task
+
+        assert machine.connects == 1 and machine.connected is None
+        assert client.timings["send"].count == 2
+
+    asyncio.run(main())
+
+
+def test_wakeup_timer():
+    machine = SimMachine("00:00:00:00:00:01")
+
+    async def main():
+        client = Client(machine.device)
+        loop = client.loop
+
+        client._wakeup_at(loop.time() + 0.05)
+        timer = client.wakeup_timer
+        # later wakeup reuses armed timer, it rearms itself on fire
+        client._wakeup_at(loop.time() + 0.15)
+        assert client.wakeup_timer is timer
+        await asyncio.sleep(0.1)
+        assert not client.wakeup.is_set()
+        assert client.wakeup_timer is not timer
+
+        # earlier wakeup replaces timer
+        client._wakeup_at(loop.time() + 0.01)
+        await asyncio.sleep(0.03)
+        assert client.wakeup.is_set() and client.wakeup_timer is None
+
+    asyncio.run(main())
+
+
+def test_keepalive_adapts():
+    machine = SimMachine("00:00:00:00:00:01", seed=0)
+    sim = Simulator([machine])
+
+    async def main():
+        with sim.patch(**FAST):
+            client = Client(machine.device)
+            client.ping()
+
+            # stable link - rarer keepalive
+            await asyncio.sleep(0.3)
+            assert client.keepalive == FAST["KEEPALIVE_MAX"]
+            assert client.timings["keepalive"].count > 1
+
+            # unstable link - more frequent keepalive
+            machine.drop_rate = 1
+            await asyncio.sleep(0.3)
+            assert client.keepalive == FAST["KEEPALIVE_MIN"]
+
+            client.ping_cancel()
+            await client.ping_task
+
+    asyncio.run(main())
+
+
+def test_load():
+    result = asyncio.run(load_test(count=24, drop_rate=0.05, disconnect_rate=0.02))
+    assert result["failed"] == 0
+    assert result["delivered"] == result["commands"]
+    assert result["errors"] > 0  # reconnects after drops
+
+
+def test_command_deadline():
+    machine = SimMachine("00:00:00:00:00:01", drop_rate=1, seed=0)
+    slow = SimMachine("00:00:00:00:00:02", latency=0.2, seed=0)
+    sim = Simulator([machine, slow])
+
+    async def expired(client: Client) -> float:
+        ts = client.loop.time()
+        future = client.send(bytes([0, 2]) + bytes(16), timeout=0.3)
+        try:
+            await future
+        except TimeoutError:
+            pass
+        assert not client.commands
+        return client.loop.time() - ts
+
+    async def main():
+        with sim.patch(**FAST):
+            # every connect fails, client parks waiting advertisement
+            client = Client(machine.device)
+            assert await expired(client) < 0.4
+            await asyncio.sleep(0.5)
+            assert client.parked
+            assert await expired(client) < 0.4
+
+            # deadline is before connection is established
+            client2 = Client(slow.device)
+            assert await expired(client2) < 0.4
+
+            for i in (client, client2):
+                i.ping_cancel()
+                await i.ping_task
+
+        assert not slow.commands
+
+    asyncio.run(main())
+
+
+def test_backoff():
+    machine = SimMachine("00:00:00:00:00:01", drop_rate=1, seed=0)
+    sim = Simulator([machine])
+
+    async def wait(check):
+        while not check():
+            await asyncio.sleep(0.01)
+
+    async def main():
+        with sim.patch(**FAST):
+            client = Client(machine.device)
+            client.ping()
+
+            # reconnect delay grows with each failure, than client parks
+            await asyncio.wait_for(wait(lambda: client.parked), 2)
+            attempts = machine.attempts
+            assert len(attempts) == CIRCUIT_FAILURES
+            gaps = [b - a for a, b in zip(attempts, attempts[1:])]
+            assert gaps[-1] > 1.5 * gaps[0]
+            assert client.errors["bleak"] == CIRCUIT_FAILURES
+
+            # no attempts while parked
+            await asyncio.sleep(0.3)
+            assert len(attempts) == CIRCUIT_FAILURES
+
+            # advertisement wakes client, one more attempt before next parking
+            client.advertised()
+            await wait(lambda: len(attempts) == CIRCUIT_FAILURES + 1)
+            await asyncio.wait_for(wait(lambda: client.parked), 1)
+
+            # pending command deadline wakes parked client
+            future = client.send(bytes([0, 2]) + bytes(16), timeout=0.5)
+            await asyncio.sleep(0.1)  # new command also wakes it for one attempt
+            assert client.parked
+            count = len(attempts)
+            try:
+                await future
+            except TimeoutError:
+                pass
+            await asyncio.wait_for(wait(lambda: len(attempts) > count), 0.2)
+
+            # machine is reachable again
+            machine.drop_rate = 0
+            client.advertised()
+            await asyncio.wait_for(wait(lambda: machine.connected), 1)
+            assert not client.parked and client.failures == 0
+
+            client.ping_cancel()
+            await client.ping_task
+
+    asyncio.run(main())
+
+
+def test_connect_latency():
+    machine = SimMachine("00:00:00:00:00:01", drop_rate=1, seed=0)
+    sim = Simulator([machine])
+
+    async def main():
+        with sim.patch(**{**FAST, "ACTIVE_TIME": 0.1}):
+            client = Client(machine.device)
+
+            # failed window ends by itself
+            client.ping()
+            await client.ping_task
+            assert not client.connect_start
+
+            # idle gap is not counted as connect latency
+            await asyncio.sleep(0.3)
+            machine.drop_rate = 0
+            client.ping()
+            while not machine.connected:
+                await asyncio.sleep(0.01)
+            assert client.connect_latency < 0.2
+
+            client.ping_cancel()
+            await client.ping_task
+
+    asyncio.run(main())
+
+
+def test_slot_wait_expires():
+    machine1 = SimMachine("00:00:00:00:00:01", seed=0)
+    machine2 = SimMachine("00:00:00:00:00:02", seed=1)
+    sim = Simulator([machine1, machine2])
+
+    async def main():
+        with sim.patch(slots=1, **FAST) as arbiter:
+            client1 = Client(machine1.device)
+            client2 = Client(machine2.device)
+
+            client1.ping()
+            while not machine1.connected:
+                await asyncio.sleep(0.01)
+
+            # window of second client ends while first one holds the slot
+            client2.ping_time = client2.loop.time() + 0.1
+            client2.ping_task = client2.loop.create_task(client2._ping_loop())
+            await asyncio.wait_for(client2.ping_task, 0.5)
+            assert not machine2.attempts and not arbiter.waiters
+
+            client1.ping_cancel()
+            await client1.ping_task
+
+        assert not machine2.attempts and not arbiter.active[SOURCE]
+
+    asyncio.run(main())
+
+
+def test_command_during_stats():
+    machine = SimMachine("00:00:00:00:00:01", seed=0)
+    sim = Simulator([machine])
+
+    async def main():
+        stats = []
+        with sim.patch(**{**FAST, "STATS_WAIT": 0.5}):
+            client = Client(
+                machine.device, stats_callback=lambda mode, data: stats.append(mode)
+            )
+            client.request_stats(1)
+            client.ping()
+            while machine.stats_mode is None:
+                await asyncio.sleep(0.01)
+
+            # command is not delayed by statistics wait
+            ts = client.loop.time()
+            await client.send(bytes([0, 2]) + bytes(16))
+            assert client.loop.time() - ts < 0.2
+            assert not stats
+
+            while not stats:
+                await asyncio.sleep(0.01)
+            assert stats == [1]
+
+            client.ping_cancel()
+            await client.ping_task
+
+    asyncio.run(main())